@@ -0,0 +1,155 @@
+# compression.py
+import re
+import secrets
+from gzip import GzipFile
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import StreamingBuffer, compress_string
+from api.metrics import REGISTRY
+
+try:
+    import brotli
+except ImportError:  # optional, ``pip install brotli`` enables ``br``
+    brotli = None
+
+ENCODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+# padding added to gzip headers (BREACH mitigation, as in Django's GZipMiddleware)
+GZIP_MAX_RANDOM_BYTES = 100
+
+compressed_responses = REGISTRY.counter(
+    'http_compressed_responses_total', 'Responses compressed by the compression middleware', ['encoding']
+)
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def negotiate_encoding(accept_encoding, available=None):
+    """
+    Pick the best encoding from an ``Accept-Encoding`` header
+
+    Honors q-values and ``*``, ties go to the server's order of preference
+    (brotli first).
+
+    Returns:
+        str or None: Chosen encoding, None for identity
+    """
+
+    available = available_encodings() if available is None else available
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = ENCODING_RE.match(part)
+        if not match:
+            continue
+        name, quality = match.group(1).lower(), match.group(2)
+        try:
+            weights[name] = float(quality) if quality is not None else 1.0
+        except ValueError:
+            continue
+
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+def _brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+async def _abrotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+    async for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+def _gzip_sequence(sequence):
+    # like django.utils.text.compress_sequence, which only flushes zlib at the end
+    # and would hold a streamed page back until its slowest section is rendered
+    buffer = StreamingBuffer()
+    filename = b'a' * secrets.randbelow(GZIP_MAX_RANDOM_BYTES)
+    with GzipFile(filename=filename, mode='wb', compresslevel=6, fileobj=buffer, mtime=0) as zfile:
+        for chunk in sequence:
+            if chunk:
+                zfile.write(chunk)
+                zfile.flush()
+                yield buffer.read()
+    yield buffer.read()
+
+async def _agzip_sequence(sequence):
+    # one gzip member per chunk, like Django's GZipMiddleware does for async streams
+    async for chunk in sequence:
+        if chunk:
+            yield compress_string(chunk, max_random_bytes=GZIP_MAX_RANDOM_BYTES)
+
+def _content_type(response):
+    return response.get('Content-Type', '').split(';')[0].strip().lower()
+
+class CompressionMiddleware:
+    """
+    Content-negotiated gzip/brotli compression of responses
+
+    Only compresses responses whose content type is listed in
+    ``COMPRESSION_CONTENT_TYPES`` and that are at least
+    ``COMPRESSION_MIN_SIZE`` bytes. Streaming responses are left alone unless
+    their type is in ``COMPRESSION_STREAMING_TYPES``, in which case every
+    chunk is flushed as soon as it is compressed, so event streams and
+    downloads pass through untouched while streamed pages keep their early
+    flushes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not settings.COMPRESSION_ENABLED or response.status_code != 200:
+            return response
+        if response.has_header('Content-Encoding') or 'no-transform' in response.get('Cache-Control', ''):
+            return response
+
+        content_type = _content_type(response)
+        if response.streaming:
+            if content_type not in settings.COMPRESSION_STREAMING_TYPES:
+                return response
+        elif content_type not in settings.COMPRESSION_CONTENT_TYPES or len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                wrapper = _abrotli_sequence if encoding == 'br' else _agzip_sequence
+                response.streaming_content = wrapper(response.streaming_content)
+            elif encoding == 'br':
+                response.streaming_content = _brotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = _gzip_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+            else:
+                compressed = compress_string(response.content, max_random_bytes=GZIP_MAX_RANDOM_BYTES)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # a compressed body is no longer byte-identical, see RFC 9110 8.8.1
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        compressed_responses.inc(encoding=encoding)
+        return response
@@ -0,0 +1,308 @@
+# loadtest.py
+import http.cookiejar
+import json
+import math
+import random
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from api.users.deletion import process_deletion, request_account_deletion
+from api.users.models import AccountDeletion, UserProfile
+
+ACTIONS = ('login', 'home', 'timeline', 'create_post', 'verify_email')
+
+DEFAULT_SCENARIO = {
+    'seed': 1,
+    'users': 8,
+    'requests': 400,
+    'mix': [
+        {'action': 'home', 'weight': 40},
+        {'action': 'timeline', 'weight': 30},
+        {'action': 'create_post', 'weight': 15},
+        {'action': 'verify_email', 'weight': 10},
+        {'action': 'login', 'weight': 5},
+    ],
+}
+
+USER_PREFIX = 'loadtest_'
+VERIFY_PREFIX = 'loadverify_'
+HASHTAGS = ('perf', 'load', 'django', 'sqlite')
+
+def load_scenario(path):
+    """
+    Read a JSONL scenario file
+
+    Lines with an ``action`` key form the traffic mix (``action``, ``weight``),
+    any other line sets run options (``seed``, ``users``, ``requests``).
+    Options missing from the file keep their defaults.
+
+    Returns:
+        dict: Scenario with ``seed``, ``users``, ``requests`` and ``mix``
+    """
+
+    scenario = {key: value for key, value in DEFAULT_SCENARIO.items() if key != 'mix'}
+    mix = []
+    with open(path) as scenario_file:
+        for number, line in enumerate(scenario_file, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'action' not in entry:
+                scenario.update(entry)
+                continue
+            if entry['action'] not in ACTIONS:
+                raise ValueError(f'Line {number}: unknown action {entry["action"]!r}, expected one of {", ".join(ACTIONS)}')
+            mix.append({'action': entry['action'], 'weight': float(entry.get('weight', 1))})
+    scenario['mix'] = mix or DEFAULT_SCENARIO['mix']
+    return scenario
+
+def build_plan(mix, users, requests_per_user, seed):
+    """
+    Draw the sequence of actions of every virtual user
+
+    Each user has its own generator seeded from ``seed`` and its index, so a
+    scenario replays the same requests whatever the thread scheduling.
+
+    Returns:
+        list: One list of action names per virtual user
+    """
+
+    names = [entry['action'] for entry in mix]
+    weights = [entry['weight'] for entry in mix]
+    return [
+        random.Random(f'{seed}:{index}').choices(names, weights, k=requests_per_user)
+        for index in range(users)
+    ]
+
+def prepare_accounts(users, seed):
+    """
+    Create the verified accounts driven by the virtual users and one
+    unverified account per user whose verification link gets clicked
+
+    Usernames carry a random tag of the run, so accounts are always created
+    fresh and never collide with real users or with another run. The shared
+    password and the verification tokens are random for every run, the
+    tokens are sent just now so their links are valid.
+
+    Returns:
+        dict: ``user_ids``, ``usernames`` and ``password`` of the verified
+        accounts, ``tokens`` of the unverified ones and ``created_ids`` of
+        every account, to hand to ``cleanup_accounts``
+    """
+
+    raw_password = secrets.token_urlsafe(16)
+    password = make_password(raw_password)
+    run = secrets.token_hex(4)
+    now = timezone.now()
+    with transaction.atomic():
+        created = User.objects.bulk_create([
+            User(username=f'{prefix}{run}_{index}', email=f'{prefix}{run}_{index}@example.com', password=password)
+            for prefix in (USER_PREFIX, VERIFY_PREFIX)
+            for index in range(users)
+        ])
+        # bulk_create only sets the ids on some backends
+        created = list(User.objects.filter(username__in=[user.username for user in created]).order_by('id'))
+        accounts = [user for user in created if user.username.startswith(USER_PREFIX)]
+        pending = [user for user in created if user.username.startswith(VERIFY_PREFIX)]
+
+        profiles = [UserProfile(user=user, is_email_verified=True) for user in accounts]
+        profiles += [
+            UserProfile(user=user, is_email_verified=False, email_verification_token=uuid.uuid4(),
+                        email_verification_sent_at=now)
+            for user in pending
+        ]
+        UserProfile.objects.bulk_create(profiles)
+    return {
+        'user_ids': [user.id for user in accounts],
+        'tokens': [str(profile.email_verification_token) for profile in profiles[len(accounts):]],
+        'usernames': [user.username for user in accounts],
+        'password': raw_password,
+        'created_ids': [user.id for user in created],
+    }
+
+def cleanup_accounts(user_ids, batch_size=500):
+    """
+    Remove the accounts created by ``prepare_accounts`` with their posts and notifications
+
+    Only the given ids are touched, never accounts matched by name. Goes
+    through the account deletion pipeline, so sharded posts, unread counters
+    and feed caches are handled like any other deletion, then drops the
+    deletion tracking rows.
+
+    Args:
+        user_ids: ``created_ids`` returned by ``prepare_accounts``
+        batch_size: Rows removed per transaction
+
+    Returns:
+        int: Number of rows removed
+    """
+
+    removed = 0
+    for user in User.objects.filter(pk__in=user_ids):
+        deletion = request_account_deletion(user)
+        for deleted in process_deletion(deletion, batch_size=batch_size):
+            removed += deleted
+    AccountDeletion.objects.filter(user_id__in=user_ids).delete()
+    return removed
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=0):
+    """
+    Serve the project's WSGI application from a background thread
+
+    Returns:
+        tuple: (server, base_url), call ``server.shutdown()`` when done
+    """
+
+    server = ThreadedWSGIServer(('127.0.0.1', port), _QuietHandler, allow_reuse_address=False)
+    server.set_app(get_internal_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True, name='loadtest-server').start()
+    return server, f'http://localhost:{server.server_port}'
+
+class _KeepStatus(urllib.request.HTTPErrorProcessor):
+    """Hand every response back as is, redirects and errors included"""
+
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+class LoadStats:
+    """Thread-safe latency and outcome counters per action"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.throttled = 0
+        self.lock_errors = 0
+
+    def record(self, action, status, elapsed, locked=False):
+        with self._lock:
+            self.latencies.setdefault(action, []).append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 429:
+                self.throttled += 1
+            elif status == 0 or status >= 400:
+                self.errors[action] = self.errors.get(action, 0) + 1
+            if locked:
+                self.lock_errors += 1
+
+    def record_lock_error(self):
+        with self._lock:
+            self.lock_errors += 1
+
+    def summary(self, duration):
+        """
+        Returns:
+            dict: Totals, throughput and per-action latency percentiles (ms)
+        """
+
+        actions = {}
+        for action, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            actions[action] = {
+                'requests': len(ordered),
+                'errors': self.errors.get(action, 0),
+                **{f'p{p}': round(percentile(ordered, p) * 1000, 1) for p in (50, 90, 99)},
+                'max': round(ordered[-1] * 1000, 1),
+            }
+        total = sum(len(samples) for samples in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            'requests': total,
+            'duration': round(duration, 3),
+            'throughput': round(total / duration, 1) if duration else 0.0,
+            'errors': errors,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'throttled': self.throttled,
+            'lock_errors': self.lock_errors,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'actions': actions,
+        }
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+class VirtualUser:
+    """One browser: its own cookie jar, CSRF token and seeded parameter choices"""
+
+    def __init__(self, index, base_url, accounts, stats, seed, timeout=30, detect_locks=True):
+        self.base_url = base_url
+        self.username = accounts['usernames'][index]
+        self.accounts = accounts
+        self.stats = stats
+        self.rng = random.Random(f'{seed}:{index}:params')
+        self.timeout = timeout
+        self.detect_locks = detect_locks
+        self.jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar), _KeepStatus())
+        self.posts = 0
+
+    def _csrf_token(self):
+        return next((cookie.value for cookie in self.jar if cookie.name == 'csrftoken'), '')
+
+    def request(self, method, path, data=None):
+        """
+        Returns:
+            tuple: (status: int, 0 on connection errors, elapsed: float seconds, locked: bool)
+        """
+
+        body = None
+        headers = {}
+        if data is not None:
+            data = {'csrfmiddlewaretoken': self._csrf_token(), **data}
+            body = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                content = response.read()
+                status = response.status
+        except (urllib.error.URLError, OSError):
+            return 0, time.perf_counter() - start, False
+        locked = self.detect_locks and status >= 500 and b'database is locked' in content
+        return status, time.perf_counter() - start, locked
+
+    def perform(self, action):
+        start = time.perf_counter()
+        locked = False
+        if action == 'login':
+            self.request('GET', reverse('login'))
+            status, _, locked = self.request('POST', reverse('login'), {'username': self.username, 'password': self.accounts['password']})
+        elif action == 'home':
+            status, _, locked = self.request('GET', reverse('home'))
+        elif action == 'timeline':
+            user_id = self.rng.choice(self.accounts['user_ids'])
+            status, _, locked = self.request('GET', reverse('user_timeline', args=[user_id]))
+        elif action == 'create_post':
+            self.posts += 1
+            mention = self.rng.choice(self.accounts['usernames'])
+            message = f'Load test post {self.posts} from {self.username} #{self.rng.choice(HASHTAGS)} @{mention}'
+            status, _, locked = self.request('POST', reverse('create_post'), {'message': message})
+        else:
+            token = self.rng.choice(self.accounts['tokens'])
+            status, _, locked = self.request('GET', reverse('verify_email', args=[token]))
+        self.stats.record(action, status, time.perf_counter() - start, locked)
+
+    def run(self, actions):
+        # every session starts logged in, like a returning user
+        self.perform('login')
+        for action in actions:
+            self.perform(action)
@@ -0,0 +1,490 @@
+# metrics.py
+import atexit
+import bisect
+import glob
+import json
+import os
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, sibling files are then folded without a lock
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric:
+    """
+    Base class for registry metrics
+
+    Counters and histograms are sharded per thread: each thread only ever
+    writes its own dict, so increments take no lock. Shards are merged when
+    the registry is collected, and the shards of finished threads are folded
+    into a retained total so servers starting a thread per request don't
+    accumulate them.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = {}
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._reap()
+                self._shards[threading.current_thread()] = values
+            return values
+
+    def _reap(self):
+        """Fold the shards of finished threads into the retained total, call with the lock held"""
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            self._merge(self._retired, self._shards.pop(thread))
+
+    def _merge(self, totals, shard):
+        """Add ``shard`` into ``totals`` without mutating values ``totals`` already holds"""
+        raise NotImplementedError
+
+    def _snapshots(self):
+        with self._shards_lock:
+            self._reap()
+            retired = dict(self._retired)
+            shards = list(self._shards.values())
+        # dict() copies atomically under the GIL
+        return [retired] + [dict(shard) for shard in shards]
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, totals, shard):
+        for key, value in shard.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+class Gauge(Metric):
+    """
+    Value that goes up and down, set directly or read from a callback at collection
+
+    Gauges of exited worker processes are dropped, not retained like counters.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Report ``function()`` as the value of this unlabelled gauge"""
+        if self.labelnames:
+            raise ValueError(f'{self.name} has labels, callbacks only serve unlabelled gauges')
+        self._function = function
+
+    def collect(self):
+        if self._function is not None:
+            return {(): self._function()}
+        return dict(self._values)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # per-bucket counts (last one is +Inf), sum
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def _merge(self, totals, shard):
+        for key, (counts, total) in shard.items():
+            merged_counts, merged_total = totals.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            totals[key] = [[a + b for a, b in zip(merged_counts, counts)], merged_total + total]
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+PROCESS_FILE_RE = re.compile(r'^(\d+)-(\d+)\.json$')
+RETIRED_FILE = 'retired.json'
+
+def _pid_alive(pid):
+    if os.name != 'posix':
+        # os.kill terminates processes on Windows, rely on the exit hook there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+@contextmanager
+def _directory_lock(directory):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_snapshot(path):
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+def _write_snapshot(path, snapshot):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as output:
+        json.dump(snapshot, output)
+    os.replace(tmp_path, path)
+
+def merge_snapshot(merged, snapshot, include_gauges=True):
+    """
+    Add the samples of ``snapshot`` into ``merged``
+
+    Counters, histograms and gauges are all summed across processes.
+
+    Args:
+        merged: Snapshot updated in place
+        snapshot: Snapshot of another process
+        include_gauges: False to leave out gauges, which die with their process
+    """
+
+    for name, family in snapshot.items():
+        if family['type'] == 'gauge' and not include_gauges:
+            continue
+        target = merged.setdefault(name, dict(family, samples=[]))
+        samples = {tuple(key): value for key, value in target['samples']}
+        for key, value in family['samples']:
+            key = tuple(key)
+            if key not in samples:
+                samples[key] = value
+            elif family['type'] == 'histogram':
+                counts, total = samples[key]
+                samples[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+            else:
+                samples[key] = samples[key] + value
+        target['samples'] = [[list(key), value] for key, value in samples.items()]
+    return merged
+
+class Registry:
+    """Holds the process's metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._process = None
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Duplicate metric: {metric.name}')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """Return a JSON serialisable snapshot of every metric in this process"""
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.documentation,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': [[list(key), value] for key, value in metric.collect().items()],
+            }
+            for metric in list(self._metrics.values())
+        }
+
+    def _process_file(self, directory):
+        """
+        Path of this process's snapshot in ``directory``
+
+        The name carries the process start time next to the pid, so a worker
+        reusing the pid of an exited one never overwrites its totals.
+        """
+
+        pid = os.getpid()
+        if self._process is None or self._process[0] != pid:
+            # first flush, or in a child forked after the parent flushed
+            self._process = (pid, time.time_ns())
+            atexit.register(self.retire, directory)
+        return os.path.join(directory, f'{pid}-{self._process[1]}.json')
+
+    def flush(self, directory, min_interval=0):
+        """
+        Write this process's snapshot to ``directory`` for multi-process scrapes
+
+        Args:
+            directory: Shared metrics directory
+            min_interval: Skip the write if the last one is more recent (seconds)
+        """
+
+        now = time.monotonic()
+        if now - self._last_flush < min_interval:
+            return
+        self._last_flush = now
+        _write_snapshot(self._process_file(directory), self.snapshot())
+
+    def retire(self, directory):
+        """
+        Fold this process's counters and histograms into the retained total on exit
+
+        Registered with ``atexit`` on the first flush. Workers that die
+        without running it are folded by the next scrape instead.
+        """
+
+        if self._process is None or self._process[0] != os.getpid() or not os.path.isdir(directory):
+            return
+        with _directory_lock(directory):
+            retired_path = os.path.join(directory, RETIRED_FILE)
+            retired = _read_snapshot(retired_path) or {}
+            _write_snapshot(retired_path, merge_snapshot(retired, self.snapshot(), include_gauges=False))
+            try:
+                os.remove(self._process_file(directory))
+            except FileNotFoundError:
+                pass
+
+    def _fold_dead(self, directory, own_file):
+        """
+        Fold the snapshots of exited processes into the retained total
+
+        A process is gone when its pid is no longer running, or when a newer
+        file carries the same pid (the pid was reused).
+
+        Returns:
+            list: Snapshot files of live sibling processes
+        """
+
+        started = {}
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            match = PROCESS_FILE_RE.match(os.path.basename(path))
+            if match and path != own_file:
+                started[path] = (int(match.group(1)), int(match.group(2)))
+        newest = {os.getpid(): self._process[1]}
+        for pid, start in started.values():
+            newest[pid] = max(start, newest.get(pid, 0))
+        dead = [path for path, (pid, start) in started.items() if start < newest[pid] or not _pid_alive(pid)]
+        if dead:
+            with _directory_lock(directory):
+                retired_path = os.path.join(directory, RETIRED_FILE)
+                retired = _read_snapshot(retired_path) or {}
+                for path in dead:
+                    snapshot = _read_snapshot(path)
+                    if snapshot is None:
+                        # already folded by a concurrent scrape
+                        continue
+                    merge_snapshot(retired, snapshot, include_gauges=False)
+                    # write before removing so a crash in between never drops totals
+                    _write_snapshot(retired_path, retired)
+                    os.remove(path)
+        return [path for path in started if path not in dead]
+
+    def collect(self, directory=None):
+        """
+        Merge this process's metrics with the snapshots of sibling processes
+
+        Counters and histograms of exited processes are kept in a retained
+        total, their gauges are dropped.
+        """
+
+        merged = self.snapshot()
+        if not directory:
+            return merged
+
+        own_file = self._process_file(directory)
+        for path in self._fold_dead(directory, own_file) + [os.path.join(directory, RETIRED_FILE)]:
+            snapshot = _read_snapshot(path)
+            if snapshot is not None:
+                merge_snapshot(merged, snapshot)
+        return merged
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def render(families):
+    """Render collected metric families in the Prometheus text exposition format"""
+    lines = []
+    for name, family in sorted(families.items()):
+        lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        names = family['labelnames']
+        for key, value in sorted(family['samples']):
+            if family['type'] == 'histogram':
+                counts, total = value
+                cumulative = 0
+                bounds = [str(bound) for bound in family['buckets']] + ['+Inf']
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(names, key, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(names, key)} {total}')
+                lines.append(f'{name}_count{_format_labels(names, key)} {cumulative}')
+            else:
+                lines.append(f'{name}{_format_labels(names, key)} {value}')
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests by view, method and status', ['view', 'method', 'status']
+)
+http_request_duration = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by view, streamed bodies included', ['view']
+)
+db_queries = REGISTRY.counter(
+    'db_queries_total',
+    'Database queries executed while serving requests, streamed bodies included '
+    '(queries run in worker threads, such as shard scatters and async streams, are not counted)',
+    ['view']
+)
+logins = REGISTRY.counter(
+    'logins_total', 'Login attempts by result (succeeded, failed, throttled)', ['result']
+)
+posts_created = REGISTRY.counter(
+    'posts_created_total', 'Posts created'
+)
+verification_emails = REGISTRY.counter(
+    'verification_emails_total', 'Verification emails by result (sent, failed)', ['result']
+)
+
+def _count_queries(counter):
+    """Count the queries of the current thread's connections into ``counter[0]``"""
+    def count_query(execute, sql, params, many, context):
+        counter[0] += 1
+        return execute(sql, params, many, context)
+
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(count_query))
+    return stack
+
+class MetricsMiddleware:
+    """
+    Record request counts, latency and DB query counts per view
+
+    Streamed responses run most of their queries while the body is iterated,
+    after this middleware returns, so their latency and queries are recorded
+    once the body is exhausted or closed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+        start = time.perf_counter()
+        with _count_queries(queries):
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        http_requests.inc(view=view, method=request.method, status=response.status_code)
+        if not response.streaming:
+            self.record(view, start, queries)
+        elif response.is_async:
+            response.streaming_content = self.aobserve(response.streaming_content, view, start, queries)
+        else:
+            response.streaming_content = self.observe(response.streaming_content, view, start, queries)
+        return response
+
+    def observe(self, streaming_content, view, start, queries):
+        chunks = iter(streaming_content)
+        try:
+            while True:
+                # only count around each chunk, the server's own work between chunks is not ours
+                with _count_queries(queries):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.record(view, start, queries)
+
+    async def aobserve(self, streaming_content, view, start, queries):
+        # deferred work of async streams runs in a worker thread, only the latency is extended
+        try:
+            async for chunk in streaming_content:
+                yield chunk
+        finally:
+            self.record(view, start, queries)
+
+    def record(self, view, start, queries):
+        http_request_duration.observe(time.perf_counter() - start, view=view)
+        if queries[0]:
+            db_queries.inc(queries[0], view=view)
+
+        directory = settings.METRICS_MULTIPROC_DIR
+        if directory:
+            REGISTRY.flush(directory, min_interval=settings.METRICS_FLUSH_INTERVAL)
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+class PostsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'api.posts'
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+        from django.db.models.signals import post_migrate
+        from .prewarm import prewarm_on_login
+        from .sharding import reserve_id_ranges
+        user_logged_in.connect(prewarm_on_login, dispatch_uid='posts.prewarm_on_login')
+        post_migrate.connect(reserve_id_ranges, sender=self, dispatch_uid='posts.reserve_id_ranges')
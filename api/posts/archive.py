@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import transaction
+from django.db.models import Q
+from .models import Post, PostArchive, PostArchiveHashtag, PostHashtag
+from .sharding import user_posts
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def archive_posts(queryset, batch_size=1000):
+    """
+    Move posts from the hot table into ``PostArchive`` in bounded batches
+
+    Every batch is copied and deleted inside its own transaction, so the
+    operation can be interrupted and re-run at any point without losing or
+    duplicating posts. Hashtag links move to ``PostArchiveHashtag`` with
+    their posts so tag timelines keep listing them.
+
+    Args:
+        queryset: Post queryset selecting the posts to archive on one shard
+        batch_size: Number of posts moved per transaction
+
+    Yields:
+        int: Number of posts moved by each batch
+    """
+
+    queryset = queryset.order_by('timestamp', 'id')
+    while True:
+        with transaction.atomic(using=queryset.db):
+            batch = list(queryset.values('id', 'user_id', 'message', 'timestamp')[:batch_size])
+            if not batch:
+                return
+            ids = [row['id'] for row in batch]
+            PostArchive.objects.using(queryset.db).bulk_create(
+                [PostArchive(**row) for row in batch],
+                ignore_conflicts=True
+            )
+            links = PostHashtag.objects.using(queryset.db).filter(post_id__in=ids).values('post_id', 'hashtag_id', 'timestamp')
+            PostArchiveHashtag.objects.using(queryset.db).bulk_create(
+                [PostArchiveHashtag(**link) for link in links],
+                ignore_conflicts=True
+            )
+            # the hot links go with their posts
+            Post.objects.using(queryset.db).filter(id__in=ids).delete()
+        yield len(batch)
+
+def encode_cursor(post):
+    """Build an opaque ``<epoch microseconds>-<id>`` timeline cursor"""
+    delta = post.timestamp - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return f'{micros}-{post.id}'
+
+def decode_cursor(cursor):
+    """
+    Parse a timeline cursor produced by ``encode_cursor``
+
+    Returns:
+        tuple: (timestamp: datetime, id: int) or None if the cursor is invalid
+    """
+
+    try:
+        micros, post_id = cursor.split('-', 1)
+        return EPOCH + timedelta(microseconds=int(micros)), int(post_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+def _page(queryset, cursor, limit):
+    if cursor:
+        timestamp, post_id = cursor
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=post_id))
+    return list(queryset.order_by('-timestamp', '-id')[:limit])
+
+def _link_page(queryset, cursor, limit):
+    if cursor:
+        timestamp, post_id = cursor
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, post_id__lt=post_id))
+    return list(queryset.select_related('post').order_by('-timestamp', '-post_id')[:limit])
+
+def tag_page(hashtag, alias, cursor=None, limit=20):
+    """
+    Fetch the newest hashtag links of one shard across the hot and archive tiers
+
+    Like ``timeline_page``, archived links are only read once the hot ones
+    run out for this cursor.
+
+    Args:
+        hashtag: Hashtag whose posts to list
+        alias: Shard to read
+        cursor: Decoded cursor from ``decode_cursor`` or None for the first page
+        limit: Number of links to return at most
+
+    Returns:
+        list: ``PostHashtag`` then ``PostArchiveHashtag`` rows with their post, newest first
+    """
+
+    links = _link_page(PostHashtag.objects.using(alias).filter(hashtag_id=hashtag.id), cursor, limit)
+    if len(links) < limit:
+        links += _link_page(
+            PostArchiveHashtag.objects.using(alias).filter(hashtag_id=hashtag.id), cursor, limit - len(links)
+        )
+    return links
+
+def timeline_page(user, cursor=None, limit=20):
+    """
+    Fetch one page of a user's timeline across the hot and archive tiers
+
+    The archive only holds posts older than the hot window, so the archive is
+    queried only once the hot posts run out for this cursor.
+
+    Args:
+        user: User whose posts to list
+        cursor: Decoded cursor from ``decode_cursor`` or None for the first page
+        limit: Page size
+
+    Returns:
+        tuple: (posts: list, next_cursor: str or None)
+    """
+
+    posts = _page(user_posts(user.pk), cursor, limit + 1)
+    if len(posts) <= limit:
+        posts += _page(user_posts(user.pk, PostArchive), cursor, limit + 1 - len(posts))
+    for post in posts:
+        # every row belongs to ``user``, which may live on another database
+        post._meta.get_field('user').set_cached_value(post, user)
+
+    next_cursor = encode_cursor(posts[limit - 1]) if len(posts) > limit else None
+    return posts[:limit], next_cursor
@@ -0,0 +1,14 @@
+from .feeds import get_user_counters
+
+def counters(request):
+    """
+    Expose the cached navbar counters of the current user
+
+    The value is a callable so pages that never render the navbar don't
+    touch the cache.
+    """
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notifications': lambda: get_user_counters(user.pk)['unread_notifications']}
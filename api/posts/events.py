@@ -0,0 +1,142 @@
+import asyncio
+import json
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+from api.metrics import REGISTRY
+
+def format_event(event, data):
+    """
+    Encode a Server-Sent Event frame
+
+    Args:
+        event: Event name
+        data: JSON serialisable payload
+
+    Returns:
+        str: SSE frame terminated by a blank line
+    """
+
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+class Subscription:
+    """
+    A single connection's bounded event buffer
+
+    Frames are pushed from any thread and consumed by the connection's event
+    loop. When the buffer is full the oldest frame is dropped and the
+    subscription is flagged as overflowed, so a slow client is told to resync
+    instead of holding an unbounded backlog in memory.
+    """
+
+    def __init__(self, loop, max_buffer):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_buffer)
+        self.overflowed = False
+
+    def push(self, frame):
+        """Schedule delivery of a frame on the subscriber's event loop"""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, frame)
+        except RuntimeError:
+            # event loop already closed, the broker will drop us on unsubscribe
+            pass
+
+    def _deliver(self, frame):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.overflowed = True
+        self.queue.put_nowait(frame)
+
+    async def get(self):
+        return await self.queue.get()
+
+class InProcessBroker:
+    """
+    Pub/sub broker that fans events out to subscribers in this process
+
+    This is the default backend and the one to use in tests. Deployments
+    running several worker processes should point ``POSTS_EVENT_BROKER`` at a
+    backend with the same ``publish``/``subscribe``/``unsubscribe`` interface
+    that relays events between processes.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, max_buffer):
+        subscription = Subscription(asyncio.get_running_loop(), max_buffer)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        # encode once, every subscriber shares the same frame
+        frame = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(frame)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Return the process-wide broker configured by ``POSTS_EVENT_BROKER``"""
+    return import_string(settings.POSTS_EVENT_BROKER)()
+
+sse_subscribers = REGISTRY.gauge(
+    'sse_subscribers', 'Live feed (SSE) connections subscribed to this process\'s broker'
+)
+sse_subscribers.set_function(lambda: getattr(get_broker(), 'subscriber_count', 0))
+
+def publish_new_post(post):
+    """Announce a newly created post to live feed subscribers"""
+    user = post.user
+    get_broker().publish('post', {
+        'id': post.id,
+        'user_id': user.id,
+        'username': user.username,
+        'full_name': user.get_full_name() or user.username,
+        'message': post.message,
+        'timestamp': post.timestamp.isoformat(),
+    })
+
+async def event_stream(broker, heartbeat, max_buffer, max_age):
+    """
+    Yield SSE frames for one connection until ``max_age`` seconds have passed
+
+    A comment frame is sent every ``heartbeat`` seconds of inactivity to keep
+    proxies from closing idle connections. Capping the connection age bounds
+    the lifetime of abandoned streams, the browser's EventSource reconnects
+    automatically.
+    """
+
+    subscription = broker.subscribe(max_buffer=max_buffer)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_age
+    try:
+        yield f'retry: {int(heartbeat * 1000)}\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                frame = await asyncio.wait_for(subscription.get(), min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_event('resync', {})
+            yield frame
+    finally:
+        broker.unsubscribe(subscription)
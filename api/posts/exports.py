@@ -0,0 +1,136 @@
+import csv
+import io
+import itertools
+import json
+import zlib
+from django.contrib.auth.models import User
+
+EXPORT_FIELDS = ['id', 'username', 'message', 'timestamp']
+
+def iter_posts_keyset(queryset, batch_size=1000):
+    """
+    Iterate over a queryset of posts in primary key order using keyset batching
+
+    Each batch is a fresh ``id > last_id`` query streamed with
+    ``QuerySet.iterator(chunk_size=...)``, so memory stays bounded by the batch
+    size no matter how many rows match. Usernames are looked up once per
+    batch over its collected user ids, since posts may live on a shard
+    without the users table.
+
+    Args:
+        queryset: Post queryset to export
+        batch_size: Number of rows fetched per batch
+
+    Yields:
+        dict: Export row for each post
+    """
+
+    queryset = queryset.order_by('id').values_list('id', 'user_id', 'message', 'timestamp')
+    last_id = 0
+    while True:
+        batch = []
+        user_ids = set()
+        for row in queryset.filter(id__gt=last_id)[:batch_size].iterator(chunk_size=batch_size):
+            batch.append(row)
+            user_ids.add(row[1])
+        if not batch:
+            break
+        usernames = dict(User.objects.filter(id__in=user_ids).values_list('id', 'username'))
+        for post_id, user_id, message, timestamp in batch:
+            yield {
+                'id': post_id,
+                'username': usernames.get(user_id, ''),
+                'message': message,
+                'timestamp': timestamp.isoformat()
+            }
+        last_id = batch[-1][0]
+        if len(batch) < batch_size:
+            break
+
+def ndjson_lines(rows):
+    """Encode rows as newline delimited JSON"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+def csv_lines(rows):
+    """Encode rows as CSV, starting with a header line"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gzip_chunks(chunks, level=6, min_flush=64 * 1024):
+    """
+    Gzip a stream of text chunks on the fly
+
+    Args:
+        chunks: Iterable of str chunks
+        level: zlib compression level
+        min_flush: Number of compressed bytes to buffer before yielding
+
+    Yields:
+        bytes: Gzip encoded output
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= min_flush:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+def buffered_chunks(chunks, min_size=64 * 1024):
+    """Join small text chunks into larger UTF-8 encoded blocks"""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= min_size:
+            yield ''.join(pending).encode('utf-8')
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+def export_stream(querysets, export_format='ndjson', compress=False, batch_size=1000):
+    """
+    Build the encoded output stream for a post export
+
+    Args:
+        querysets: Post/PostArchive querysets to export, one after another
+        export_format: One of ``EXPORT_FORMATS``
+        compress: Whether to gzip the output
+        batch_size: Number of rows fetched per batch
+
+    Returns:
+        tuple: (chunks: iterable, content_type: str)
+    """
+
+    encoder, content_type = EXPORT_FORMATS[export_format]
+    rows = itertools.chain.from_iterable(
+        iter_posts_keyset(queryset, batch_size=batch_size) for queryset in querysets
+    )
+    chunks = encoder(rows)
+    if compress:
+        return gzip_chunks(chunks), content_type
+    return buffered_chunks(chunks), content_type
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count
+from api.users.models import UserProfile
+from .models import Post
+from .sharding import attach_users, merge_newest, scatter
+
+RECENT_POSTS_KEY = 'feeds:recent_posts'
+SIDEBAR_USERS_KEY = 'feeds:sidebar_users'
+# held by the one prewarm job recomputing the shared feeds
+WARMING_KEY = 'feeds:warming'
+
+def counters_key(user_id):
+    return f'feeds:counters:{user_id}'
+
+def compute_recent_posts():
+    limit = settings.FEEDS_RECENT_POSTS
+    newest = scatter(lambda alias: list(Post.objects.using(alias).order_by('-timestamp', '-id')[:limit]))
+    return attach_users(merge_newest(newest, limit))
+
+def compute_sidebar_users():
+    # per-shard counts grouped on the (user, timestamp) index, summed across shards
+    post_counts = {}
+    for counts in scatter(lambda alias: list(
+        Post.objects.using(alias).order_by().values_list('user_id').annotate(count=Count('id'))
+    )):
+        for user_id, count in counts:
+            post_counts[user_id] = post_counts.get(user_id, 0) + count
+    users = list(User.objects.only('id', 'username').order_by('username'))
+    for user in users:
+        user.post_count = post_counts.get(user.id, 0)
+    return users
+
+def compute_user_counters(user_id):
+    unread = UserProfile.objects.filter(user_id=user_id).values_list('unread_notifications', flat=True).first()
+    return {'unread_notifications': unread or 0}
+
+def get_recent_posts():
+    """Most recent posts of every user, cached for ``FEEDS_CACHE_SECONDS``"""
+    return cache.get_or_set(RECENT_POSTS_KEY, compute_recent_posts, settings.FEEDS_CACHE_SECONDS)
+
+def get_sidebar_users():
+    """Users with their post counts for the home sidebar, cached for ``FEEDS_CACHE_SECONDS``"""
+    return cache.get_or_set(SIDEBAR_USERS_KEY, compute_sidebar_users, settings.FEEDS_CACHE_SECONDS)
+
+def get_user_counters(user_id):
+    """Per-user navbar counters, cached for ``FEEDS_CACHE_SECONDS``"""
+    return cache.get_or_set(counters_key(user_id), lambda: compute_user_counters(user_id), settings.FEEDS_CACHE_SECONDS)
+
+def warm_feeds(user_id):
+    """
+    Compute and store every cached value the first home page of ``user_id`` needs
+
+    The counters of ``user_id`` are always refreshed. The feeds shared by
+    every user are only computed when missing, and by a single job at a time,
+    so a burst of logins runs the global aggregations once.
+    """
+
+    computes = {RECENT_POSTS_KEY: compute_recent_posts, SIDEBAR_USERS_KEY: compute_sidebar_users}
+    cached = cache.get_many(list(computes))
+    missing = [key for key in computes if key not in cached]
+    if missing and cache.add(WARMING_KEY, True, settings.FEEDS_CACHE_SECONDS):
+        try:
+            cache.set_many({key: computes[key]() for key in missing}, settings.FEEDS_CACHE_SECONDS)
+        finally:
+            cache.delete(WARMING_KEY)
+    cache.set(counters_key(user_id), compute_user_counters(user_id), settings.FEEDS_CACHE_SECONDS)
+
+def invalidate_feeds():
+    """Drop the feed caches shared by every user, call it once a post is committed"""
+    cache.delete_many([RECENT_POSTS_KEY, SIDEBAR_USERS_KEY])
+
+def invalidate_counters(user_ids):
+    """Drop the cached counters of ``user_ids``, call it once their counts changed"""
+    cache.delete_many([counters_key(user_id) for user_id in user_ids])
@@ -0,0 +1,102 @@
+import re
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Hashtag, HashtagCount, PostHashtag
+
+HASHTAG_RE = re.compile(r'(?<![\w#&])#(\w{1,100})')
+TRENDING_CACHE_KEY = 'posts:trending'
+
+def extract_hashtags(message):
+    """
+    Parse the distinct, lower-cased hashtags out of a post message
+
+    Args:
+        message: Post message text
+
+    Returns:
+        list: Hashtag names without the leading ``#``
+    """
+
+    return sorted({name.lower() for name in HASHTAG_RE.findall(message or '')})
+
+def bucket_start(timestamp):
+    """Floor a timestamp to the start of its trending counter bucket"""
+    seconds = settings.HASHTAG_BUCKET_SECONDS
+    epoch = int(timestamp.timestamp())
+    return timestamp - timedelta(seconds=epoch % seconds, microseconds=timestamp.microsecond)
+
+def record_hashtags(post):
+    """
+    Store the hashtags of a newly created post and bump their counters
+
+    A fixed number of queries is issued whatever the number of tags. Call it
+    inside the transaction that creates the post.
+
+    Args:
+        post: Post instance that was just created
+
+    Returns:
+        list: Hashtag instances linked to the post
+    """
+
+    names = extract_hashtags(post.message)
+    if not names:
+        return []
+
+    Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+    hashtags = list(Hashtag.objects.filter(name__in=names))
+    PostHashtag.objects.using(post._state.db).bulk_create(
+        [PostHashtag(post=post, hashtag=hashtag, timestamp=post.timestamp) for hashtag in hashtags],
+        ignore_conflicts=True
+    )
+
+    bucket = bucket_start(post.timestamp)
+    HashtagCount.objects.bulk_create(
+        [HashtagCount(hashtag=hashtag, bucket=bucket) for hashtag in hashtags],
+        ignore_conflicts=True
+    )
+    HashtagCount.objects.filter(bucket=bucket, hashtag__in=hashtags).update(count=F('count') + 1)
+    return hashtags
+
+def compute_trending(window_hours=None, limit=None):
+    """
+    Rank hashtags by use over the sliding window from the bucketed counters
+
+    Only the counter rows of the window are read, never the posts.
+
+    Returns:
+        list: ``(name, count)`` tuples, most used first
+    """
+
+    window_hours = window_hours or settings.HASHTAG_TRENDING_WINDOW_HOURS
+    limit = limit or settings.HASHTAG_TRENDING_LIMIT
+    since = bucket_start(timezone.now() - timedelta(hours=window_hours))
+    rows = (
+        HashtagCount.objects.filter(bucket__gte=since)
+        .values('hashtag__name')
+        .annotate(total=Sum('count'))
+        .order_by('-total', 'hashtag__name')[:limit]
+    )
+    return [(row['hashtag__name'], row['total']) for row in rows]
+
+def refresh_trending():
+    """Recompute the trending snapshot and store it in the cache"""
+    snapshot = compute_trending()
+    cache.set(TRENDING_CACHE_KEY, snapshot, settings.HASHTAG_TRENDING_REFRESH_SECONDS)
+    return snapshot
+
+def trending_hashtags():
+    """Return the cached trending snapshot, recomputing it once it expires"""
+    snapshot = cache.get(TRENDING_CACHE_KEY)
+    if snapshot is None:
+        snapshot = refresh_trending()
+    return snapshot
+
+def prune_hashtag_counts(keep_hours):
+    """Delete counter buckets older than ``keep_hours``, returns the number removed"""
+    cutoff = bucket_start(timezone.now() - timedelta(hours=keep_hours))
+    deleted, _ = HashtagCount.objects.filter(bucket__lt=cutoff).delete()
+    return deleted
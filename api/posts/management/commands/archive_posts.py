@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from api.posts.models import Post
+from api.posts.archive import archive_posts
+from api.posts.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Move posts older than the hot window into the archive table in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.POSTS_HOT_WINDOW_DAYS,
+                            help='Archive posts older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.POSTS_ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        self.stdout.write(f'Archiving posts older than {cutoff:%Y-%m-%d %H:%M}')
+
+        total = 0
+        for alias in shard_aliases():
+            queryset = Post.objects.using(alias).filter(timestamp__lt=cutoff)
+            for moved in archive_posts(queryset, batch_size=options['batch_size']):
+                total += moved
+                self.stdout.write(f'Archived {total} posts so far ({alias})')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully archived {total} posts!')
+        )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.core.cache import caches
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from api.ratelimit import ratelimit
+import time
+
+CACHE_METHODS = ('get', 'set', 'add', 'incr', 'get_many', 'set_many', 'delete')
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead and cache round-trips of the rate limiter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        cache = caches[settings.RATELIMIT_CACHE]
+        calls = {'count': 0}
+
+        # count every cache operation issued during the run
+        for name in CACHE_METHODS:
+            original = getattr(cache, name)
+
+            def counted(*args, _original=original, **kwargs):
+                calls['count'] += 1
+                return _original(*args, **kwargs)
+
+            setattr(cache, name, counted)
+
+        def view(request):
+            return HttpResponse('ok')
+
+        limited_view = ratelimit('benchmark')(view)
+        request = RequestFactory().post('/benchmark/', REMOTE_ADDR='203.0.113.7')
+        request.user = AnonymousUser()
+
+        try:
+            with override_settings(RATELIMIT_ENABLED=True, RATELIMITS={'benchmark': {'rate': f'{total * 2}/h', 'key': 'ip'}}):
+                start = time.perf_counter()
+                for _ in range(total):
+                    view(request)
+                baseline = time.perf_counter() - start
+
+                limited_view(request)
+                calls['count'] = 0
+                start = time.perf_counter()
+                for _ in range(total):
+                    limited_view(request)
+                limited = time.perf_counter() - start
+        finally:
+            for name in CACHE_METHODS:
+                cache.__dict__.pop(name, None)
+
+        overhead_us = (limited - baseline) / total * 1e6
+        self.stdout.write(f'Cache backend: {cache.__class__.__name__}')
+        self.stdout.write(f'Requests: {total}')
+        self.stdout.write(f'Cache round-trips per request: {calls["count"] / total:.2f}')
+        self.stdout.write(f'Overhead per request: {overhead_us:.1f} us')
+        self.stdout.write(
+            self.style.SUCCESS('Benchmark complete!')
+        )
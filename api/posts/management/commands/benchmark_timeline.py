@@ -0,0 +1,122 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from api.compression import available_encodings, brotli
+from api.posts.models import Post
+from api.posts.sharding import is_sharded
+import statistics
+import time
+import tracemalloc
+import zlib
+
+BENCHMARK_USERNAME = 'benchmark_timeline'
+
+
+class Command(BaseCommand):
+    help = 'Measure time to first byte, total time and peak memory of large timelines, buffered vs streamed (seeded data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=5000, help='Posts on the benchmarked timeline')
+        parser.add_argument('--page-size', type=int, default=1000, help='Posts rendered per page')
+        parser.add_argument('--runs', type=int, default=5, help='Requests per mode, the median is reported')
+
+    def seed(self, posts):
+        user = User.objects.create(username=BENCHMARK_USERNAME, email=f'{BENCHMARK_USERNAME}@example.com')
+        now = timezone.now()
+        Post.objects.bulk_create([
+            Post(user_id=user.pk, message=f'Benchmark post {number} #benchmark', timestamp=now - timedelta(minutes=number))
+            for number in range(posts)
+        ], batch_size=1000)
+        return user
+
+    def decoder(self, encoding):
+        """Return a callable turning compressed chunks into the bytes a browser could render"""
+        if encoding == 'br':
+            return brotli.Decompressor().process
+        if encoding == 'gzip':
+            return zlib.decompressobj(zlib.MAX_WBITS | 16).decompress
+        return lambda chunk: chunk
+
+    def fetch(self, client, url, encoding, trace_memory):
+        """
+        Request ``url`` and read the body without keeping it
+
+        The time to first byte is taken at the first chunk that decodes to
+        some HTML, a chunk holding only a compression header renders nothing.
+
+        Returns:
+            tuple: (ttfb: float seconds, total: float seconds, size: int bytes, peak: int bytes or None)
+        """
+
+        headers = {'HTTP_ACCEPT_ENCODING': encoding} if encoding else {}
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            response = client.get(url, **headers)
+            if response.streaming:
+                decode = self.decoder(encoding)
+                size, ttfb = 0, None
+                for chunk in response.streaming_content:
+                    size += len(chunk)
+                    if ttfb is None and decode(chunk):
+                        ttfb = time.perf_counter() - start
+            else:
+                # a buffered response only reaches the client once it is complete
+                ttfb = time.perf_counter() - start
+                size = len(response.content)
+            total = time.perf_counter() - start
+            ttfb = total if ttfb is None else ttfb
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        if response.status_code != 200:
+            raise CommandError(f'{url} answered {response.status_code}')
+        return ttfb, total, size, peak
+
+    def handle(self, *args, **options):
+        if options['posts'] < 1 or options['page_size'] < 1 or options['runs'] < 1:
+            raise CommandError('--posts, --page-size and --runs must be positive')
+        if is_sharded():
+            raise CommandError('Seeded posts are rolled back in a single transaction, run against an unsharded database')
+
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        modes = [(streaming, encoding) for streaming in (False, True) for encoding in ('',) + available_encodings()]
+        results = []
+        with transaction.atomic():
+            user = self.seed(options['posts'])
+            url = reverse('user_timeline', args=[user.pk])
+            self.stdout.write(f'Timeline of {options["posts"]} posts, {options["page_size"]} per page, {options["runs"]} runs per mode')
+
+            with override_settings(POSTS_TIMELINE_PAGE_SIZE=options['page_size']):
+                for streaming, encoding in modes:
+                    with override_settings(POSTS_TIMELINE_STREAMING=streaming):
+                        # warm up templates and the query plan cache
+                        self.fetch(client, url, encoding, trace_memory=False)
+                        timings = [self.fetch(client, url, encoding, trace_memory=False) for _ in range(options['runs'])]
+                        _, _, size, peak = self.fetch(client, url, encoding, trace_memory=True)
+                    results.append({
+                        'mode': 'streamed' if streaming else 'buffered',
+                        'encoding': encoding or 'identity',
+                        'ttfb': statistics.median(timing[0] for timing in timings) * 1000,
+                        'total': statistics.median(timing[1] for timing in timings) * 1000,
+                        'size': size,
+                        'peak': peak,
+                    })
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'\n{"mode":<10}{"encoding":<10}{"ttfb ms":>10}{"total ms":>10}{"bytes":>10}{"peak KiB":>10}')
+        for row in results:
+            self.stdout.write(
+                f'{row["mode"]:<10}{row["encoding"]:<10}{row["ttfb"]:>10.1f}{row["total"]:>10.1f}'
+                f'{row["size"]:>10}{row["peak"] / 1024:>10.0f}'
+            )
+        self.stdout.write(
+            self.style.SUCCESS('\nBenchmark complete!')
+        )
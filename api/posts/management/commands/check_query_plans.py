@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.queryplans import check_view_plans, hot_view_requests, seed_plan_data
+
+
+class Command(BaseCommand):
+    help = 'Check that the queries behind the hot views use indexes (seeded data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--posts-per-user', type=int, default=50)
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            fixtures = seed_plan_data(users=options['users'], posts_per_user=options['posts_per_user'])
+            for name, method, url, data, login_user in hot_view_requests(fixtures):
+                view_failures = check_view_plans(method, url, data=data, login_user=login_user)
+                if view_failures:
+                    self.stdout.write(self.style.ERROR(f'{name}: {len(view_failures)} unindexed queries'))
+                    for sql, violations in view_failures:
+                        self.stdout.write(f'  {sql}')
+                        for violation in violations:
+                            self.stdout.write(f'    -> {violation}')
+                else:
+                    self.stdout.write(f'{name}: OK')
+                failures.extend(view_failures)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries scan or sort without an index')
+        self.stdout.write(
+            self.style.SUCCESS('All hot view queries use indexes!')
+        )
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from api.posts.models import Post
+from api.posts.sharding import assign_shard, user_posts
 from api.users.models import UserProfile
 from api.utils import sample_posts, users_data
 from django.utils import timezone
@@ -47,7 +48,7 @@ class Command(BaseCommand):
 
         # Mock posts the 2 Users
         for user in created_users:
-            existing_posts = Post.objects.filter(user=user).count()
+            existing_posts = user_posts(user.pk).count()
             posts_to_create = max(0, 5 - existing_posts)
             
             for i in range(posts_to_create):
@@ -61,13 +62,13 @@ class Command(BaseCommand):
                     minutes=minutes_ago
                 )
                 
-                Post.objects.create(
+                Post.objects.using(assign_shard(user.pk)).create(
                     user=user,
                     message=random.choice(sample_posts),
                     timestamp=post_time
                 )
             
-            total_posts = Post.objects.filter(user=user).count()
+            total_posts = user_posts(user.pk).count()
             self.stdout.write(f'User {user.username} now has {total_posts} posts')
 
         self.stdout.write(
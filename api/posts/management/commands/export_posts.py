@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.conf import settings
+from api.posts.models import Post, PostArchive
+from api.posts.exports import EXPORT_FORMATS, export_stream
+from api.posts.sharding import shard_aliases, user_posts
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Stream posts for one user (or all users) as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username whose posts to export (default: all users)')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output on the fly')
+        parser.add_argument('--output', help='Output file path (default: stdout)')
+        parser.add_argument('--batch-size', type=int, default=settings.POSTS_EXPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User not found: {options["user"]}')
+            querysets = [user_posts(user.pk), user_posts(user.pk, PostArchive)]
+        else:
+            querysets = [model.objects.using(alias) for alias in shard_aliases() for model in (Post, PostArchive)]
+
+        chunks, _ = export_stream(
+            querysets,
+            export_format=options['format'],
+            compress=options['gzip'],
+            batch_size=options['batch_size']
+        )
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+            self.stdout.write(
+                self.style.SUCCESS(f'Exported posts to {options["output"]}')
+            )
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
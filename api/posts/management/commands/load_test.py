@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import OperationalError
+from django.test import override_settings
+from api.loadtest import (
+    DEFAULT_SCENARIO, LoadStats, VirtualUser, build_plan, cleanup_accounts, load_scenario, prepare_accounts,
+    start_server
+)
+
+
+class Command(BaseCommand):
+    help = 'Replay a seeded traffic mix from concurrent sessions and report throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', help='JSONL scenario file (default: built-in mix)')
+        parser.add_argument('--url', help='Target a running server sharing this database instead of starting one')
+        parser.add_argument('--port', type=int, default=0, help='Port of the local server (default: any free port)')
+        parser.add_argument('--users', type=int, help='Concurrent virtual users, one thread each')
+        parser.add_argument('--requests', type=int, help='Total requests across all users')
+        parser.add_argument('--seed', type=int, help='Seed of the request plan')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--no-ratelimit', action='store_true', help='Disable rate limiting on the local server')
+        parser.add_argument('--report', help='Also write the summary as JSON to this path')
+        parser.add_argument('--allow-db-writes', action='store_true',
+                            help='Run with DEBUG off, test accounts and posts are written to the configured database')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['allow_db_writes']:
+            raise CommandError('The load test writes accounts and posts to the database, pass --allow-db-writes to run with DEBUG off')
+        try:
+            scenario = load_scenario(options['scenario']) if options['scenario'] else dict(DEFAULT_SCENARIO)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Invalid scenario: {e}')
+        for key in ('users', 'requests', 'seed'):
+            if options[key] is not None:
+                scenario[key] = options[key]
+        if scenario['users'] < 1 or scenario['requests'] < scenario['users']:
+            raise CommandError('Need at least one user and one request per user')
+
+        plan = build_plan(scenario['mix'], scenario['users'], scenario['requests'] // scenario['users'], scenario['seed'])
+        stats = LoadStats()
+
+        def count_lock_errors(sender, **kwargs):
+            error = sys.exc_info()[1]
+            if isinstance(error, OperationalError) and 'locked' in str(error):
+                stats.record_lock_error()
+
+        accounts = prepare_accounts(scenario['users'], scenario['seed'])
+        server = None
+        try:
+            overrides = {}
+            if options['url']:
+                base_url = options['url'].rstrip('/')
+            else:
+                if options['no_ratelimit']:
+                    overrides['RATELIMIT_ENABLED'] = False
+                server, base_url = start_server(options['port'])
+
+            mix = ', '.join(f'{entry["action"]}={entry["weight"]:g}' for entry in scenario['mix'])
+            self.stdout.write(f'Target: {base_url}')
+            self.stdout.write(f'Users: {scenario["users"]}, requests: {scenario["requests"]}, seed: {scenario["seed"]}')
+            self.stdout.write(f'Mix: {mix}')
+
+            # the in-process server reports lock errors directly, remote ones are read from the response
+            if server:
+                got_request_exception.connect(count_lock_errors)
+            with override_settings(**overrides):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=scenario['users'], thread_name_prefix='loadtest') as pool:
+                    users = [
+                        VirtualUser(index, base_url, accounts, stats, scenario['seed'],
+                                    timeout=options['timeout'], detect_locks=server is None)
+                        for index in range(scenario['users'])
+                    ]
+                    list(pool.map(lambda item: item[0].run(item[1]), zip(users, plan)))
+                duration = time.perf_counter() - start
+        finally:
+            got_request_exception.disconnect(count_lock_errors)
+            if server:
+                server.shutdown()
+                server.server_close()
+            removed = cleanup_accounts(accounts['created_ids'])
+            self.stdout.write(f'Removed the load test accounts ({removed} rows)')
+
+        summary = stats.summary(duration)
+        self.stdout.write(
+            f'\n{summary["requests"]} requests in {summary["duration"]:.2f}s '
+            f'({summary["throughput"]:.1f} req/s), errors: {summary["errors"]} '
+            f'({summary["error_rate"]:.2%}), throttled: {summary["throttled"]}, '
+            f'SQLite lock errors: {summary["lock_errors"]}'
+        )
+        self.stdout.write(f'Statuses: {", ".join(f"{status}={count}" for status, count in summary["statuses"].items())}')
+        self.stdout.write(f'\n{"action":<14}{"requests":>10}{"errors":>8}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+        for action, row in summary['actions'].items():
+            self.stdout.write(
+                f'{action:<14}{row["requests"]:>10}{row["errors"]:>8}'
+                f'{row["p50"]:>10.1f}{row["p90"]:>10.1f}{row["p99"]:>10.1f}{row["max"]:>10.1f}'
+            )
+
+        if options['report']:
+            with open(options['report'], 'w') as report:
+                json.dump({'scenario': scenario, 'summary': summary}, report, indent=2)
+
+        self.stdout.write(
+            self.style.SUCCESS('\nLoad test complete!')
+        )
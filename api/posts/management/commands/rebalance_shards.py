@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.utils import timezone
+from api.posts.models import Post, PostArchive, UserShard
+from api.posts.sharding import home_shard, is_sharded, move_user_posts, shard_aliases, sweep_due_at, sweep_user_posts
+import time
+
+
+class Command(BaseCommand):
+    help = 'Move users whose posts are not on their hash ring shard, e.g. after adding a shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only move this username')
+        parser.add_argument('--to', help='Target shard for --user (default: its hash ring shard)')
+        parser.add_argument('--batch-size', type=int, default=settings.POSTS_SHARD_MOVE_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='List the moves without running them')
+        parser.add_argument('--no-wait', action='store_true',
+                            help='Do not wait for cached placements to expire, the next run sweeps the old shards')
+
+    def adopt_unplaced_users(self):
+        """Pin users whose posts predate sharding to the shard already holding them"""
+        placed = set(UserShard.objects.values_list('user_id', flat=True))
+        adopted = 0
+        for alias in shard_aliases():
+            user_ids = set()
+            for model in (Post, PostArchive):
+                user_ids.update(model.objects.using(alias).order_by().values_list('user_id', flat=True).distinct())
+            new_ids = user_ids - placed
+            UserShard.objects.bulk_create([UserShard(user_id=user_id, shard=alias) for user_id in new_ids], ignore_conflicts=True)
+            placed |= new_ids
+            adopted += len(new_ids)
+        return adopted
+
+    def sweep(self, placements, batch_size):
+        """Move posts written to the old shard of moved users by workers with a stale placement"""
+        swept = 0
+        for placement in placements:
+            for moved in sweep_user_posts(placement, batch_size=batch_size):
+                swept += moved
+        if swept:
+            self.stdout.write(f'Swept {swept} posts written to old shards during moves')
+        return swept
+
+    def handle(self, *args, **options):
+        if not is_sharded():
+            raise CommandError('Posts are not sharded, list the shard aliases in POSTS_SHARDS first')
+        if options['to'] and options['to'] not in shard_aliases():
+            raise CommandError(f'Unknown shard: {options["to"]}')
+
+        settling = set()
+        if not options['dry_run']:
+            adopted = self.adopt_unplaced_users()
+            if adopted:
+                self.stdout.write(f'Pinned {adopted} users to the shard holding their posts')
+            now = timezone.now()
+            due = []
+            for placement in UserShard.objects.exclude(moved_from=''):
+                if sweep_due_at(placement) <= now:
+                    due.append(placement)
+                else:
+                    settling.add(placement.user_id)
+            self.sweep(due, options['batch_size'])
+
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User not found: {options["user"]}')
+            placements = UserShard.objects.filter(user_id=user.pk)
+            if not placements.exists():
+                placements = [UserShard(user_id=user.pk, shard=home_shard(user.pk))]
+        else:
+            placements = UserShard.objects.order_by('user_id').iterator()
+
+        users = posts = 0
+        moved_ids = []
+        for placement in placements:
+            target = options['to'] or home_shard(placement.user_id)
+            if placement.shard == target:
+                continue
+            if placement.user_id in settling:
+                self.stdout.write(f'User {placement.user_id}: skipped, its last move is not swept yet')
+                continue
+            users += 1
+            self.stdout.write(f'User {placement.user_id}: {placement.shard} -> {target}')
+            if options['dry_run']:
+                continue
+            for moved in move_user_posts(placement.user_id, target, batch_size=options['batch_size']):
+                posts += moved
+                self.stdout.write(f'  moved {moved} posts ({posts} total)')
+            moved_ids.append(placement.user_id)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{users} users would move'))
+            return
+        if moved_ids:
+            if options['no_wait']:
+                self.stdout.write('Old shards will be swept by the next run, once cached placements expired')
+            else:
+                moved = list(UserShard.objects.filter(user_id__in=moved_ids).exclude(moved_from=''))
+                wait = max((sweep_due_at(placement) - timezone.now()).total_seconds() for placement in moved) if moved else 0
+                if wait > 0:
+                    self.stdout.write(f'Waiting {wait:.0f}s for cached placements to expire')
+                    time.sleep(wait)
+                self.sweep(moved, options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully moved {posts} posts of {users} users!')
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from api.posts.hashtags import prune_hashtag_counts, refresh_trending
+
+
+class Command(BaseCommand):
+    help = 'Refresh the cached trending hashtags snapshot and prune old counter buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-hours', type=int, default=settings.HASHTAG_COUNT_RETENTION_HOURS,
+                            help='Delete counter buckets older than this many hours')
+
+    def handle(self, *args, **options):
+        snapshot = refresh_trending()
+        for name, count in snapshot:
+            self.stdout.write(f'#{name}: {count}')
+
+        pruned = prune_hashtag_counts(options['keep_hours'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Refreshed {len(snapshot)} trending hashtags, pruned {pruned} counter buckets')
+        )
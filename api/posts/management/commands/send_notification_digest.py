@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.core.mail import get_connection
+from django.conf import settings
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from django.utils import timezone
+from api.posts.mentions import attach_posts
+from api.posts.models import Notification
+from api.utils import EmailService
+
+
+class Command(BaseCommand):
+    help = 'Email each user a digest of their unread, not yet emailed mentions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_DIGEST_BATCH_SIZE,
+                            help='Number of recipients handled per batch')
+
+    def handle(self, *args, **options):
+        email_service = EmailService()
+        notifications_url = settings.SITE_URL.rstrip('/') + reverse('notifications')
+        pending = Notification.objects.filter(emailed_at__isnull=True, is_read=False)
+
+        sent = failed = 0
+        last_recipient_id = 0
+        while True:
+            recipient_ids = list(
+                pending.filter(recipient_id__gt=last_recipient_id)
+                .order_by('recipient_id')
+                .values_list('recipient_id', flat=True)
+                .distinct()[:options['batch_size']]
+            )
+            if not recipient_ids:
+                break
+            last_recipient_id = recipient_ids[-1]
+
+            # only the newest mentions of each recipient are listed, the digest links to the rest
+            started = timezone.now()
+            batch = list(
+                pending.filter(recipient_id__in=recipient_ids)
+                .annotate(
+                    rank=Window(RowNumber(), partition_by=F('recipient_id'), order_by=[F('created_at').desc(), F('id').desc()]),
+                    pending_count=Window(Count('id'), partition_by=F('recipient_id')),
+                )
+                .filter(rank__lte=settings.NOTIFICATION_DIGEST_MAX_MENTIONS)
+                .select_related('recipient', 'actor')
+            )
+            by_recipient = {}
+            attached = attach_posts(batch)
+            for notification in attached:
+                by_recipient.setdefault(notification.recipient, []).append(notification)
+            # mentions in deleted posts would otherwise stay pending forever
+            skipped_ids = {notification.id for notification in batch} - {notification.id for notification in attached}
+
+            emailed_recipient_ids = []
+            # one backend connection for the whole batch
+            with get_connection() as connection:
+                for recipient, items in by_recipient.items():
+                    if not recipient.email:
+                        continue
+                    success, _ = email_service.send_template_email(
+                        request=None,
+                        template_name='notifications/digest_email.html',
+                        subject='You were mentioned - Social Network',
+                        to_email=recipient.email,
+                        context={
+                            'username': recipient.username,
+                            'first_name': recipient.first_name,
+                            'notifications': items,
+                            'more': max(items[0].pending_count - settings.NOTIFICATION_DIGEST_MAX_MENTIONS, 0),
+                            'notifications_url': notifications_url
+                        },
+                        connection=connection
+                    )
+                    if success:
+                        sent += 1
+                        emailed_recipient_ids.append(recipient.id)
+                    else:
+                        failed += 1
+
+            now = timezone.now()
+            Notification.objects.filter(id__in=skipped_ids).update(emailed_at=now)
+            # the mentions left out of the digest are covered by its link
+            pending.filter(recipient_id__in=emailed_recipient_ids, created_at__lte=started).update(emailed_at=now)
+            self.stdout.write(f'Processed {len(recipient_ids)} recipients ({sent} sent, {failed} failed so far)')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully sent {sent} digests ({failed} failed)')
+        )
@@ -0,0 +1,137 @@
+import re
+from collections import Counter
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from api.users.models import UserProfile
+from .feeds import invalidate_counters
+from .models import Notification, Post, PostArchive
+from .sharding import shard_for_user
+
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.@+-]{1,150})')
+
+def extract_mentions(message):
+    """
+    Parse the distinct ``@username`` mentions out of a post message
+
+    Args:
+        message: Post message text
+
+    Returns:
+        list: Mentioned usernames without the leading ``@``
+    """
+
+    return sorted({name.rstrip('.') for name in MENTION_RE.findall(message or '')} - {''})
+
+def record_mentions(post):
+    """
+    Notify every user mentioned in a newly created post
+
+    All mentions are resolved with a single query, notifications are bulk
+    inserted and the recipients' unread counters bumped with one UPDATE.
+    Call it inside the transaction that creates the post.
+
+    Args:
+        post: Post instance that was just created
+
+    Returns:
+        list: IDs of the notified users
+    """
+
+    usernames = extract_mentions(post.message)
+    if not usernames:
+        return []
+
+    recipient_ids = list(
+        User.objects.filter(username__in=usernames, is_active=True)
+        .exclude(id=post.user_id)
+        .values_list('id', flat=True)
+    )
+    if not recipient_ids:
+        return []
+
+    Notification.objects.bulk_create([
+        Notification(recipient_id=recipient_id, actor_id=post.user_id, post=post, created_at=post.timestamp)
+        for recipient_id in recipient_ids
+    ])
+    UserProfile.objects.filter(user_id__in=recipient_ids).update(
+        unread_notifications=F('unread_notifications') + 1
+    )
+    return recipient_ids
+
+def release_unread(notification_ids):
+    """
+    Decrement the unread counters of recipients of notifications about to be removed
+
+    Call it inside the transaction that deletes the notifications, the
+    cached counters are invalidated once it commits.
+
+    Args:
+        notification_ids: IDs of the notifications being deleted
+    """
+
+    unread = Counter(
+        Notification.objects.filter(id__in=notification_ids, is_read=False)
+        .values_list('recipient_id', flat=True)
+    )
+    by_amount = {}
+    for recipient_id, amount in unread.items():
+        by_amount.setdefault(amount, []).append(recipient_id)
+    for amount, recipient_ids in by_amount.items():
+        UserProfile.objects.filter(user_id__in=recipient_ids).update(
+            unread_notifications=Greatest(F('unread_notifications') - amount, Value(0))
+        )
+    transaction.on_commit(lambda: invalidate_counters(list(unread)))
+
+def delete_notifications(post_ids):
+    """
+    Delete the notifications of posts being deleted, keeping unread counters right
+
+    Args:
+        post_ids: IDs of the posts being deleted
+
+    Returns:
+        int: Number of notifications deleted
+    """
+
+    with transaction.atomic():
+        ids = list(Notification.objects.filter(post_id__in=post_ids).values_list('id', flat=True))
+        release_unread(ids)
+        deleted, _ = Notification.objects.filter(id__in=ids).delete()
+    return deleted
+
+def attach_posts(notifications):
+    """
+    Load the posts of notifications from their authors' shards
+
+    Posts are fetched with one query per shard, archived posts stand in for
+    posts that were moved to the archive. Notifications whose post was
+    deleted are left out.
+
+    Args:
+        notifications: Notification instances
+
+    Returns:
+        list: Notifications with ``post`` loaded
+    """
+
+    ids_by_shard = {}
+    for notification in notifications:
+        ids_by_shard.setdefault(shard_for_user(notification.actor_id), set()).add(notification.post_id)
+
+    posts = {}
+    for alias, post_ids in ids_by_shard.items():
+        posts.update(Post.objects.using(alias).in_bulk(post_ids))
+        missing = post_ids - posts.keys()
+        if missing:
+            posts.update(PostArchive.objects.using(alias).in_bulk(missing))
+
+    post_field = Notification._meta.get_field('post')
+    attached = []
+    for notification in notifications:
+        post = posts.get(notification.post_id)
+        if post is not None:
+            post_field.set_cached_value(notification, post)
+            attached.append(notification)
+    return attached
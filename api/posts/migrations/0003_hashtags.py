@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-19 03:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_postarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_links', to='posts.hashtag')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashtag_links', to='posts.post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HashtagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='posts.hashtag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='posthashtag',
+            index=models.Index(fields=['hashtag', '-timestamp'], name='posts_tag_ts_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='posthashtag',
+            constraint=models.UniqueConstraint(fields=('post', 'hashtag'), name='posts_posthashtag_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='hashtagcount',
+            constraint=models.UniqueConstraint(fields=('bucket', 'hashtag'), name='posts_hashtagcount_unique'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-19 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_notification'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='postarchive',
+            name='posts_archive_user_ts_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='posthashtag',
+            name='posts_tag_ts_idx',
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-timestamp'], name='posts_post_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='posts_post_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postarchive',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='posts_archive_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='posthashtag',
+            index=models.Index(fields=['hashtag', '-timestamp', '-post'], name='posts_tag_ts_idx'),
+        ),
+    ]
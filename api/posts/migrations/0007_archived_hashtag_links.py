@@ -0,0 +1,67 @@
+# Generated by Django 4.2 on 2026-10-19 04:18
+
+import re
+from django.db import DEFAULT_DB_ALIAS, migrations, models, router
+import django.db.models.deletion
+
+# frozen copy of api.posts.hashtags.HASHTAG_RE
+HASHTAG_RE = re.compile(r'(?<![\w#&])#(\w{1,100})')
+
+
+def relink_archived_hashtags(apps, schema_editor):
+    """Recreate the links of posts archived while archiving still dropped them"""
+    PostArchive = apps.get_model('posts', 'PostArchive')
+    PostArchiveHashtag = apps.get_model('posts', 'PostArchiveHashtag')
+    Hashtag = apps.get_model('posts', 'Hashtag')
+    alias = schema_editor.connection.alias
+    if not router.allow_migrate_model(alias, PostArchiveHashtag):
+        return
+
+    last_id = 0
+    while True:
+        batch = list(
+            PostArchive.objects.using(alias).filter(id__gt=last_id).order_by('id')
+            .values('id', 'message', 'timestamp')[:1000]
+        )
+        if not batch:
+            return
+        last_id = batch[-1]['id']
+        names = {row['id']: {name.lower() for name in HASHTAG_RE.findall(row['message'])} for row in batch}
+        hashtag_ids = dict(
+            Hashtag.objects.using(DEFAULT_DB_ALIAS).filter(name__in=set().union(*names.values()))
+            .values_list('name', 'id')
+        )
+        PostArchiveHashtag.objects.using(alias).bulk_create([
+            PostArchiveHashtag(post_id=row['id'], hashtag_id=hashtag_ids[name], timestamp=row['timestamp'])
+            for row in batch
+            for name in names[row['id']]
+            if name in hashtag_ids
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostArchiveHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('hashtag', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_post_links', to='posts.hashtag')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashtag_links', to='posts.postarchive')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postarchivehashtag',
+            index=models.Index(fields=['hashtag', '-timestamp', '-post'], name='posts_archive_tag_ts_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='postarchivehashtag',
+            constraint=models.UniqueConstraint(fields=('post', 'hashtag'), name='posts_archivehashtag_unique'),
+        ),
+        migrations.RunPython(relink_archived_hashtags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_archived_hashtag_links'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usershard',
+            name='moved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='usershard',
+            name='moved_from',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
@@ -2,13 +2,125 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+# Posts, archived posts and hashtag links may live on a shard without the
+# tables they point to (see sharding.py), their cross-database foreign keys
+# are enforced by Django rather than by database constraints.
+
 class Post(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts", db_constraint=False)
     message = models.TextField(max_length=500)
     timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ["-timestamp"]
+        indexes = [
+            models.Index(fields=["-timestamp", "-id"], name="posts_post_ts_idx"),
+            models.Index(fields=["user", "-timestamp", "-id"], name="posts_post_user_ts_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.message[:50]}..."
+
+class PostArchive(models.Model):
+    """Cold tier for posts older than the hot window, keeps the original post id"""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_posts", db_constraint=False)
+    message = models.TextField(max_length=500)
+    timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-timestamp"]
+        indexes = [
+            models.Index(fields=["user", "-timestamp", "-id"], name="posts_archive_user_ts_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.message[:50]}..."
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+class PostHashtag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="hashtag_links")
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="post_links", db_constraint=False)
+    # copy of post.timestamp so tag timelines are served straight from the index
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "hashtag"], name="posts_posthashtag_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["hashtag", "-timestamp", "-post"], name="posts_tag_ts_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.hashtag.name} on post {self.post_id}"
+
+class PostArchiveHashtag(models.Model):
+    """Hashtag link of an archived post, moved out of ``PostHashtag`` along with its post"""
+    post = models.ForeignKey(PostArchive, on_delete=models.CASCADE, related_name="hashtag_links")
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="archived_post_links", db_constraint=False)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "hashtag"], name="posts_archivehashtag_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["hashtag", "-timestamp", "-post"], name="posts_archive_tag_ts_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.hashtag.name} on archived post {self.post_id}"
+
+class HashtagCount(models.Model):
+    """Number of posts using a hashtag within one time bucket"""
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="counts")
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bucket", "hashtag"], name="posts_hashtagcount_unique"),
+        ]
+
+    def __str__(self):
+        return f"#{self.hashtag.name} @ {self.bucket:%Y-%m-%d %H:%M}: {self.count}"
+
+class Notification(models.Model):
+    """Tells ``recipient`` that ``actor`` mentioned them in ``post``"""
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    # kept when the post is archived, the archive reuses the post id
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, related_name="notifications", db_constraint=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    is_read = models.BooleanField(default=False)
+    emailed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["recipient", "-created_at"], name="posts_notif_recipient_idx"),
+            models.Index(fields=["recipient"], condition=models.Q(emailed_at__isnull=True),
+                         name="posts_notif_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.actor.username} mentioned {self.recipient.username} in post {self.post_id}"
+
+class UserShard(models.Model):
+    """Database alias holding a user's posts once posts are sharded"""
+    user_id = models.IntegerField(primary_key=True)
+    shard = models.CharField(max_length=100)
+    assigned_at = models.DateTimeField(default=timezone.now)
+    # shard of the last move, swept again once stale cached placements expired
+    moved_from = models.CharField(max_length=100, blank=True, default="")
+    moved_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"user {self.user_id} on {self.shard}"
@@ -0,0 +1,99 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+from api.metrics import REGISTRY
+from .feeds import warm_feeds
+
+logger = logging.getLogger('api.posts')
+
+prewarm_jobs = REGISTRY.counter(
+    'feed_prewarm_jobs_total',
+    'Feed prewarm jobs by result (submitted, deduplicated, dropped, completed, failed)',
+    ['result']
+)
+prewarm_queue_depth = REGISTRY.gauge(
+    'feed_prewarm_queue_depth', 'Feed prewarm jobs queued or running'
+)
+
+class PrewarmPool:
+    """
+    Bounded thread pool computing a user's feed caches in the background
+
+    At most one job per user is queued or running at a time, and once
+    ``max_queue`` jobs are pending new ones are dropped instead of piling up
+    behind a slow database.
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='feed-prewarm')
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def submit(self, user_id):
+        """
+        Queue a prewarm job for ``user_id``
+
+        Returns:
+            bool: True if a job was queued
+        """
+
+        with self._lock:
+            if user_id in self._inflight:
+                prewarm_jobs.inc(result='deduplicated')
+                return False
+            if len(self._inflight) >= self.max_queue:
+                prewarm_jobs.inc(result='dropped')
+                logger.warning(f'Feed prewarm queue full, dropped job for user {user_id}')
+                return False
+            self._inflight.add(user_id)
+
+        try:
+            self._executor.submit(self._run, user_id)
+        except RuntimeError:
+            # interpreter shutting down
+            self._done(user_id)
+            prewarm_jobs.inc(result='dropped')
+            return False
+        prewarm_jobs.inc(result='submitted')
+        return True
+
+    @property
+    def depth(self):
+        """Number of jobs queued or running"""
+        return len(self._inflight)
+
+    def _done(self, user_id):
+        with self._lock:
+            self._inflight.discard(user_id)
+
+    def _run(self, user_id):
+        try:
+            warm_feeds(user_id)
+            prewarm_jobs.inc(result='completed')
+        except Exception:
+            prewarm_jobs.inc(result='failed')
+            logger.exception(f'Feed prewarm failed for user {user_id}')
+        finally:
+            self._done(user_id)
+            connections.close_all()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide prewarm pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PrewarmPool(settings.FEEDS_PREWARM_WORKERS, settings.FEEDS_PREWARM_QUEUE_DEPTH)
+        return _pool
+
+prewarm_queue_depth.set_function(lambda: _pool.depth if _pool is not None else 0)
+
+def prewarm_on_login(sender, request, user, **kwargs):
+    """``user_logged_in`` receiver queueing the user's feed computations"""
+    if settings.FEEDS_PREWARM_ENABLED:
+        get_pool().submit(user.pk)
@@ -0,0 +1,303 @@
+import bisect
+import hashlib
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from .models import Notification, Post, PostArchive, PostArchiveHashtag, PostHashtag, UserShard
+
+logger = logging.getLogger('api.posts')
+
+# models living on the shard of the user who wrote the post, everything else stays on default
+SHARDED_MODELS = {'posts.post', 'posts.postarchive', 'posts.posthashtag', 'posts.postarchivehashtag'}
+
+def shard_aliases():
+    """Database aliases holding posts, ``['default']`` when posts are not sharded"""
+    return list(settings.POSTS_SHARDS) or [DEFAULT_DB_ALIAS]
+
+def is_sharded():
+    return len(shard_aliases()) > 1
+
+class HashRing:
+    """Consistent hash ring, adding a node only moves the keys it takes over"""
+
+    def __init__(self, nodes, replicas=100):
+        self._ring = sorted((self._hash(f'{node}#{index}'), node) for node in nodes for index in range(replicas))
+        self._hashes = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+    def get(self, key):
+        index = bisect.bisect(self._hashes, self._hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+@lru_cache(maxsize=8)
+def _ring(nodes, replicas):
+    return HashRing(nodes, replicas)
+
+def home_shard(user_id):
+    """Shard the hash ring places ``user_id`` on"""
+    return _ring(tuple(shard_aliases()), settings.POSTS_SHARD_REPLICAS).get(user_id)
+
+def _placement_key(user_id):
+    return f'posts:shard:{user_id}'
+
+def shard_for_user(user_id):
+    """
+    Database alias holding the posts of ``user_id``
+
+    The ``UserShard`` lookup table is authoritative, so rebalancing can move a
+    user at its own pace. Users who never posted fall back to the hash ring.
+    """
+
+    shards = shard_aliases()
+    if len(shards) == 1:
+        return shards[0]
+    alias = cache.get(_placement_key(user_id))
+    if alias is None:
+        alias = UserShard.objects.filter(user_id=user_id).values_list('shard', flat=True).first()
+        if alias is None:
+            return home_shard(user_id)
+        cache.set(_placement_key(user_id), alias, settings.POSTS_SHARD_CACHE_SECONDS)
+    return alias
+
+def assign_shard(user_id):
+    """Pin ``user_id`` to a shard before writing their first post, returns its alias"""
+    shards = shard_aliases()
+    if len(shards) == 1:
+        return shards[0]
+    alias = cache.get(_placement_key(user_id))
+    if alias is None:
+        placement, _ = UserShard.objects.get_or_create(user_id=user_id, defaults={'shard': home_shard(user_id)})
+        alias = placement.shard
+        cache.set(_placement_key(user_id), alias, settings.POSTS_SHARD_CACHE_SECONDS)
+    return alias
+
+def user_posts(user_id, model=Post):
+    """Queryset of the posts (or archived posts) of ``user_id`` on their shard"""
+    return model.objects.using(shard_for_user(user_id)).filter(user_id=user_id)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _run_on_shard(fn, alias):
+    try:
+        return fn(alias)
+    finally:
+        # pool threads open their own connections
+        connections.close_all()
+
+def scatter(fn, shards=None):
+    """
+    Call ``fn(alias)`` on every shard in parallel
+
+    Returns:
+        list: Results in shard order
+    """
+
+    global _pool
+    shards = shard_aliases() if shards is None else shards
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.POSTS_SHARD_SCATTER_WORKERS, thread_name_prefix='shard-scatter')
+    return list(_pool.map(lambda alias: _run_on_shard(fn, alias), shards))
+
+def merge_newest(results, limit, key=lambda post: (post.timestamp, post.id)):
+    """Heap-merge per-shard lists sorted newest first and keep the ``limit`` newest"""
+    return list(itertools.islice(heapq.merge(*results, key=key, reverse=True), limit))
+
+def attach_users(objects):
+    """Set ``obj.user`` on shard rows with a single query against the users database"""
+    user_field = None
+    missing = set()
+    for obj in objects:
+        user_field = user_field or obj._meta.get_field('user')
+        if not user_field.is_cached(obj):
+            missing.add(obj.user_id)
+    if missing:
+        users = User.objects.in_bulk(missing)
+        for obj in objects:
+            if obj.user_id in users:
+                user_field.set_cached_value(obj, users[obj.user_id])
+    return objects
+
+def reserve_id_range(alias):
+    """
+    Start the post id sequence of a shard at ``index << POSTS_SHARD_ID_BITS``
+
+    Keeps post ids unique across shards so notifications, cursors and exports
+    can keep using them as global identifiers. The floor only ever moves up,
+    so new shards must be appended to ``POSTS_SHARDS``, never inserted.
+    """
+
+    shards = shard_aliases()
+    base = shards.index(alias) << settings.POSTS_SHARD_ID_BITS
+    if not base:
+        return
+    table = Post._meta.db_table
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, base])
+            elif row[0] < base:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [base, table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {table})))",
+                [table, base]
+            )
+        else:
+            logger.warning(f'Cannot reserve a post id range on {alias} ({connection.vendor})')
+
+def reserve_id_ranges(sender, using, **kwargs):
+    """``post_migrate`` receiver reserving the id range of the migrated shard"""
+    if is_sharded() and using in shard_aliases():
+        reserve_id_range(using)
+
+def _copy_posts(user_id, source, target, batch_size):
+    while True:
+        batch = list(Post.objects.using(source).filter(user_id=user_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        old_ids = [post.id for post in batch]
+        links = list(PostHashtag.objects.using(source).filter(post_id__in=old_ids).values('post_id', 'hashtag_id', 'timestamp'))
+        with transaction.atomic(using=source), transaction.atomic(), transaction.atomic(using=target):
+            moved = Post.objects.using(target).bulk_create([
+                Post(user_id=user_id, message=post.message, timestamp=post.timestamp) for post in batch
+            ])
+            new_ids = {old_id: post.id for old_id, post in zip(old_ids, moved)}
+            PostHashtag.objects.using(target).bulk_create(
+                [PostHashtag(post_id=new_ids[link.pop('post_id')], **link) for link in links],
+                ignore_conflicts=True
+            )
+            Notification.objects.filter(actor_id=user_id, post_id__in=old_ids).update(
+                post_id=Case(*[When(post_id=old_id, then=Value(new_id)) for old_id, new_id in new_ids.items()])
+            )
+            Post.objects.using(source).filter(id__in=old_ids).delete()
+        yield len(batch)
+
+    while True:
+        batch = list(PostArchive.objects.using(source).filter(user_id=user_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        ids = [post.id for post in batch]
+        links = list(PostArchiveHashtag.objects.using(source).filter(post_id__in=ids).values('post_id', 'hashtag_id', 'timestamp'))
+        with transaction.atomic(using=source), transaction.atomic(using=target):
+            PostArchive.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+            PostArchiveHashtag.objects.using(target).bulk_create(
+                [PostArchiveHashtag(**link) for link in links],
+                ignore_conflicts=True
+            )
+            PostArchive.objects.using(source).filter(id__in=ids).delete()
+        yield len(batch)
+
+def move_user_posts(user_id, target, batch_size=500):
+    """
+    Move every post of ``user_id`` to the ``target`` shard in bounded batches
+
+    The placement is switched first so new posts land on ``target`` while the
+    old ones are copied over. Moved posts get fresh ids from the target's
+    range and their notifications are repointed. Archived posts keep their
+    ids, hashtag links move with both. Each batch is copied, repointed and
+    then deleted from the source, so an interrupted move can be resumed by
+    running it again.
+
+    Workers may still hold the old placement in their cache for up to
+    ``POSTS_SHARD_CACHE_SECONDS`` and write new posts to the source, so the
+    source is recorded and must be swept with ``sweep_user_posts`` once that
+    time has passed.
+
+    Yields:
+        int: Number of posts moved by each batch
+    """
+
+    source = shard_for_user(user_id)
+    if source != target:
+        UserShard.objects.update_or_create(
+            user_id=user_id, defaults={'shard': target, 'moved_from': source, 'moved_at': timezone.now()}
+        )
+    else:
+        UserShard.objects.update_or_create(user_id=user_id, defaults={'shard': target})
+    cache.delete(_placement_key(user_id))
+    if source == target:
+        return
+    yield from _copy_posts(user_id, source, target, batch_size)
+
+def sweep_due_at(placement):
+    """When cached placements from before the last move of ``placement`` have all expired"""
+    return placement.moved_at + timedelta(seconds=settings.POSTS_SHARD_CACHE_SECONDS)
+
+def sweep_user_posts(placement, batch_size=500):
+    """
+    Move the posts written to the previous shard of a moved user after the switch
+
+    Must only run once ``sweep_due_at(placement)`` has passed, the sweep is
+    then marked done.
+
+    Yields:
+        int: Number of posts moved by each batch
+    """
+
+    yield from _copy_posts(placement.user_id, placement.moved_from, placement.shard, batch_size)
+    UserShard.objects.filter(user_id=placement.user_id, moved_at=placement.moved_at).update(moved_from='', moved_at=None)
+
+class PostShardRouter:
+    """
+    Route posts, archived posts and their hashtag links to the author's shard
+
+    Queries built from a manager carry no routing hints and must pick their
+    shard explicitly (``user_posts``/``scatter``). Related lookups and saves
+    are routed from the instance involved.
+    """
+
+    def _route(self, model, instance, write):
+        if instance is None or not is_sharded():
+            return None
+        if model._meta.label_lower not in SHARDED_MODELS:
+            # e.g. ``post.user``, Django would otherwise follow the post to its shard
+            return DEFAULT_DB_ALIAS if instance._meta.label_lower in SHARDED_MODELS else None
+        if instance._meta.label_lower in SHARDED_MODELS and instance._state.db:
+            return instance._state.db
+        if isinstance(instance, User):
+            return shard_for_user(instance.pk)
+        if isinstance(instance, Notification):
+            return shard_for_user(instance.actor_id)
+        if isinstance(instance, (PostHashtag, PostArchiveHashtag)):
+            post = type(instance).post.field.get_cached_value(instance, None)
+            return post._state.db if post is not None else None
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is None:
+            return None
+        return assign_shard(user_id) if write else shard_for_user(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints.get('instance'), write=False)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints.get('instance'), write=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if SHARDED_MODELS & {obj1._meta.label_lower, obj2._meta.label_lower}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in settings.POSTS_SHARDS:
+            return None
+        return f'{app_label}.{model_name}' in SHARDED_MODELS
@@ -0,0 +1,444 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from api.users.models import UserProfile
+from .archive import archive_posts, decode_cursor, encode_cursor, tag_page, timeline_page
+from .events import InProcessBroker, event_stream, format_event
+from .exports import export_stream, iter_posts_keyset
+from .hashtags import compute_trending, extract_hashtags, prune_hashtag_counts, record_hashtags
+from .mentions import extract_mentions, record_mentions
+from .prewarm import PrewarmPool, prewarm_jobs
+from .models import Hashtag, HashtagCount, Notification, Post, PostArchive, PostArchiveHashtag, PostHashtag, UserShard
+from .sharding import (
+    HashRing, PostShardRouter, merge_newest, move_user_posts, scatter, shard_aliases, shard_for_user, sweep_user_posts,
+    user_posts
+)
+
+
+
+def create_user(username, **kwargs):
+    user = User.objects.create_user(username, f'{username}@example.com', 'test-password', **kwargs)
+    UserProfile.objects.create(user=user, is_email_verified=True)
+    return user
+
+def create_posts(user, count, message='Post {number}'):
+    """Create ``count`` posts one minute apart, newest first"""
+    now = timezone.now()
+    return [
+        Post.objects.create(user=user, message=message.format(number=number), timestamp=now - timedelta(minutes=number))
+        for number in range(count)
+    ]
+
+def serial_scatter(fn, shards=None):
+    """``scatter`` without the thread pool, whose connections can't see the test transaction"""
+    return [fn(alias) for alias in (shard_aliases() if shards is None else shards)]
+
+def walk_timeline(user, limit):
+    ids, cursor = [], None
+    while True:
+        posts, next_cursor = timeline_page(user, cursor=decode_cursor(cursor) if cursor else None, limit=limit)
+        ids.extend(post.id for post in posts)
+        if next_cursor is None:
+            return ids
+        cursor = next_cursor
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False)
+class ExportTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.posts = create_posts(self.alice, 4) + create_posts(self.bob, 3)
+        for _ in archive_posts(Post.objects.filter(user=self.alice, timestamp__lt=timezone.now() - timedelta(minutes=2))):
+            pass
+
+    def test_keyset_batches_cover_every_row_once(self):
+        rows = list(iter_posts_keyset(Post.objects.filter(user__in=[self.alice, self.bob]), batch_size=2))
+        ids = [row['id'] for row in rows]
+        self.assertEqual(ids, sorted(Post.objects.filter(user__in=[self.alice, self.bob]).values_list('id', flat=True)))
+        self.assertEqual({row['username'] for row in rows}, {'alice', 'bob'})
+
+    def test_exact_batch_multiple(self):
+        rows = list(iter_posts_keyset(Post.objects.filter(user=self.bob), batch_size=3))
+        self.assertEqual(len(rows), 3)
+
+    def test_ndjson_spans_hot_and_archived_posts(self):
+        chunks, content_type = export_stream(
+            [Post.objects.filter(user=self.alice), PostArchive.objects.filter(user=self.alice)], batch_size=1
+        )
+        rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual(content_type, 'application/x-ndjson')
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(post.id for post in self.posts[:4]))
+
+    def test_csv_gzip(self):
+        chunks, content_type = export_stream([Post.objects.filter(user=self.bob)], export_format='csv', compress=True)
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(b''.join(chunks)).decode())))
+        self.assertEqual(content_type, 'text/csv')
+        self.assertEqual([row['message'] for row in rows], ['Post 0', 'Post 1', 'Post 2'])
+
+    def test_view_exports_own_posts_only(self):
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('export_posts'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual({row['username'] for row in rows}, {'bob'})
+        self.assertEqual(self.client.get(reverse('export_posts'), {'all': '1'}).status_code, 403)
+
+
+class TimelinePagingTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('paged')
+        self.posts = create_posts(self.user, 7, message='Post {number} #paging')
+        self.expected = [post.id for post in self.posts]
+
+    def archive_oldest(self, count):
+        oldest = self.posts[-count].timestamp
+        for _ in archive_posts(user_posts(self.user.pk).filter(timestamp__lte=oldest), batch_size=2):
+            pass
+
+    def test_cursor_round_trip(self):
+        post = self.posts[0]
+        self.assertEqual(decode_cursor(encode_cursor(post)), (post.timestamp, post.id))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+
+    def test_pages_span_hot_and_archive_tiers(self):
+        self.archive_oldest(4)
+        self.assertEqual(user_posts(self.user.pk).count(), 3)
+        self.assertEqual(user_posts(self.user.pk, PostArchive).count(), 4)
+        for limit in (1, 2, 3, 7, 10):
+            self.assertEqual(walk_timeline(self.user, limit), self.expected)
+
+    def test_tied_timestamps_are_ordered_by_id(self):
+        user_posts(self.user.pk).update(timestamp=self.posts[0].timestamp)
+        self.assertEqual(walk_timeline(self.user, 2), sorted(self.expected, reverse=True))
+
+    def test_archiving_is_resumable(self):
+        batches = archive_posts(user_posts(self.user.pk), batch_size=3)
+        self.assertEqual(next(batches), 3)
+        batches.close()
+        self.assertEqual(sum(archive_posts(user_posts(self.user.pk), batch_size=3)), 4)
+        self.assertEqual(walk_timeline(self.user, 3), self.expected)
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False)
+class HashtagTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('tagger')
+        self.posts = create_posts(self.user, 7, message='Post {number} #paging')
+        for post in self.posts:
+            record_hashtags(post)
+        self.hashtag = Hashtag.objects.get(name='paging')
+        self.expected = [post.id for post in self.posts]
+        self.shard = shard_for_user(self.user.pk)
+
+    def archive_oldest(self, count):
+        oldest = self.posts[-count].timestamp
+        for _ in archive_posts(user_posts(self.user.pk).filter(timestamp__lte=oldest), batch_size=2):
+            pass
+
+    def test_extract_hashtags(self):
+        self.assertEqual(extract_hashtags('#Django and #django, #python3 but not a&#39;b or ##twice'), ['django', 'python3'])
+
+    def test_record_hashtags_links_and_counts(self):
+        post = Post.objects.create(user=self.user, message='#Paging and #paging, #python3')
+        self.assertEqual([hashtag.name for hashtag in record_hashtags(post)], ['paging', 'python3'])
+        self.assertEqual(PostHashtag.objects.using(self.shard).filter(hashtag=self.hashtag).count(), 8)
+        self.assertEqual(HashtagCount.objects.filter(hashtag=self.hashtag).aggregate(total=Sum('count'))['total'], 8)
+        self.assertEqual(HashtagCount.objects.get(hashtag__name='python3').count, 1)
+
+    def test_trending_window_and_pruning(self):
+        old = Post.objects.create(user=self.user, message='#stale', timestamp=timezone.now() - timedelta(days=3))
+        record_hashtags(old)
+        self.assertEqual(compute_trending(window_hours=24, limit=5), [('paging', 7)])
+        self.assertEqual(compute_trending(window_hours=96, limit=5), [('paging', 7), ('stale', 1)])
+        self.assertEqual(prune_hashtag_counts(keep_hours=24), 1)
+        self.assertEqual(compute_trending(window_hours=96, limit=5), [('paging', 7)])
+
+    def test_archiving_moves_hashtag_links(self):
+        self.archive_oldest(4)
+        self.assertEqual(PostHashtag.objects.using(self.shard).count(), 3)
+        self.assertEqual(PostArchiveHashtag.objects.using(self.shard).count(), 4)
+
+        links = tag_page(self.hashtag, self.shard, limit=5)
+        self.assertEqual([link.post_id for link in links], self.expected[:5])
+        self.assertIsInstance(links[-1].post, PostArchive)
+        cursor = decode_cursor(encode_cursor(links[-1]))
+        self.assertEqual([link.post_id for link in tag_page(self.hashtag, self.shard, cursor=cursor)], self.expected[5:])
+
+    @mock.patch('api.posts.views.scatter', serial_scatter)
+    def test_tag_view_pages_into_archive(self):
+        self.archive_oldest(4)
+        with override_settings(POSTS_TIMELINE_PAGE_SIZE=4):
+            first = self.client.get(reverse('tag_timeline', args=['Paging']))
+            second = self.client.get(reverse('tag_timeline', args=['paging']), {'cursor': first.context['next_cursor']})
+        self.assertEqual([post.id for post in first.context['posts']], self.expected[:4])
+        self.assertEqual([post.id for post in second.context['posts']], self.expected[4:])
+        self.assertIsNone(second.context['next_cursor'])
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False)
+class MentionTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.author = create_user('author')
+        self.reader = create_user('reader')
+        self.gone = create_user('gone', is_active=False)
+
+    def mention(self, count, message='Hi @reader {number}'):
+        posts = create_posts(self.author, count, message=message)
+        for post in posts:
+            record_mentions(post)
+        return posts
+
+    def send_digest(self):
+        call_command('send_notification_digest', stdout=open('/dev/null', 'w'))
+
+    def test_extract_mentions(self):
+        self.assertEqual(extract_mentions('Hi @reader. cc @a.b, mail x@example.com'), ['a.b', 'reader'])
+
+    def test_record_mentions_notifies_active_users_once(self):
+        post = Post.objects.create(user=self.author, message='@reader @reader @gone @author @nobody')
+        self.assertEqual(record_mentions(post), [self.reader.id])
+        notification = Notification.objects.get()
+        self.assertEqual((notification.recipient, notification.actor, notification.post_id), (self.reader, self.author, post.id))
+        self.assertEqual(UserProfile.objects.get(user=self.reader).unread_notifications, 1)
+
+    def test_create_post_records_mentions(self):
+        self.client.force_login(self.author)
+        response = self.client.post(reverse('create_post'), {'message': 'Hello @reader'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        post = user_posts(self.author.pk).get()
+        self.assertTrue(Notification.objects.filter(recipient=self.reader, post_id=post.id).exists())
+
+    def test_notifications_view_marks_read(self):
+        self.mention(2)
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('notifications'))
+        self.assertEqual(len(response.context['notifications']), 2)
+        self.assertFalse(Notification.objects.filter(is_read=False).exists())
+        self.assertEqual(UserProfile.objects.get(user=self.reader).unread_notifications, 0)
+
+    @override_settings(NOTIFICATION_DIGEST_MAX_MENTIONS=2)
+    def test_digest_lists_the_newest_mentions_once(self):
+        self.mention(3)
+        self.send_digest()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+        body = mail.outbox[0].alternatives[0][0] if mail.outbox[0].alternatives else mail.outbox[0].body
+        self.assertIn('Hi @reader 0', body)
+        self.assertIn('Hi @reader 1', body)
+        self.assertNotIn('Hi @reader 2', body)
+        self.assertFalse(Notification.objects.filter(emailed_at__isnull=True).exists())
+
+        self.send_digest()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_digest_retires_mentions_of_deleted_posts(self):
+        posts = self.mention(1)
+        user_posts(self.author.pk).filter(pk=posts[0].pk).delete()
+        self.send_digest()
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(Notification.objects.filter(emailed_at__isnull=True).exists())
+
+
+class EventStreamTests(SimpleTestCase):
+
+    def collect(self, count, publish=(), max_buffer=10, heartbeat=60, max_age=60):
+        """Open a stream, publish ``publish`` once subscribed and return its first ``count`` frames"""
+        broker = InProcessBroker()
+
+        async def run():
+            stream = event_stream(broker, heartbeat=heartbeat, max_buffer=max_buffer, max_age=max_age)
+            frames = [await stream.__anext__()]
+            self.assertEqual(broker.subscriber_count, 1)
+            for number in publish:
+                broker.publish('post', {'id': number})
+            async for frame in stream:
+                frames.append(frame)
+                if len(frames) == count:
+                    break
+            await stream.aclose()
+            return frames
+
+        frames = asyncio.run(run())
+        self.assertEqual(broker.subscriber_count, 0)
+        return frames
+
+    def test_format_event(self):
+        self.assertEqual(format_event('post', {'id': 1, 'message': 'a\nb'}), 'event: post\ndata: {"id":1,"message":"a\\nb"}\n\n')
+
+    def test_published_events_reach_subscribers(self):
+        frames = self.collect(3, publish=[1, 2])
+        self.assertEqual(frames, ['retry: 60000\n\n', format_event('post', {'id': 1}), format_event('post', {'id': 2})])
+
+    def test_heartbeat_and_max_age(self):
+        frames = self.collect(10, heartbeat=0.01, max_age=0.035)
+        self.assertEqual(frames[0], 'retry: 10\n\n')
+        self.assertEqual(set(frames[1:]), {': heartbeat\n\n'})
+        self.assertLess(len(frames), 10)
+
+    def test_overflow_drops_oldest_and_asks_to_resync(self):
+        frames = self.collect(4, publish=[1, 2, 3], max_buffer=2)
+        self.assertEqual(frames[1:], [format_event('resync', {}), format_event('post', {'id': 2}), format_event('post', {'id': 3})])
+
+
+class PrewarmPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.warmed = []
+        patcher = mock.patch('api.posts.prewarm.warm_feeds', self.warm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.release.set)
+        self.pool = PrewarmPool(max_workers=1, max_queue=2)
+
+    def warm(self, user_id):
+        self.release.wait(5)
+        if user_id < 0:
+            raise ValueError('broken feed')
+        self.warmed.append(user_id)
+
+    def jobs(self):
+        return prewarm_jobs.collect()
+
+    def drain(self):
+        self.release.set()
+        self.pool._executor.shutdown(wait=True)
+
+    def test_one_job_per_user(self):
+        before = self.jobs()
+        self.assertTrue(self.pool.submit(1))
+        self.assertFalse(self.pool.submit(1))
+        self.assertEqual(self.pool.depth, 1)
+        self.drain()
+        self.assertEqual(self.warmed, [1])
+        self.assertEqual(self.pool.depth, 0)
+        after = self.jobs()
+        self.assertEqual(after[('deduplicated',)] - before.get(('deduplicated',), 0), 1)
+        self.assertEqual(after[('completed',)] - before.get(('completed',), 0), 1)
+
+    def test_full_queue_drops_new_jobs(self):
+        self.assertTrue(self.pool.submit(1))
+        self.assertTrue(self.pool.submit(2))
+        with self.assertLogs('api.posts', 'WARNING'):
+            self.assertFalse(self.pool.submit(3))
+        self.drain()
+        self.assertEqual(sorted(self.warmed), [1, 2])
+
+    def test_failed_jobs_free_their_slot(self):
+        with self.assertLogs('api.posts', 'ERROR'):
+            self.assertTrue(self.pool.submit(-1))
+            self.drain()
+        self.assertEqual(self.pool.depth, 0)
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=True)
+class PrewarmOnLoginTests(TestCase):
+
+    def test_login_queues_a_prewarm(self):
+        user = create_user('warm')
+        with mock.patch('api.posts.prewarm.get_pool') as get_pool:
+            self.assertTrue(self.client.login(username='warm', password='test-password'))
+            with override_settings(FEEDS_PREWARM_ENABLED=False):
+                self.client.login(username='warm', password='test-password')
+        get_pool.return_value.submit.assert_called_once_with(user.pk)
+
+
+class ShardingHelperTests(SimpleTestCase):
+
+    def test_hash_ring_only_moves_keys_to_the_new_node(self):
+        before = HashRing(['a', 'b'])
+        after = HashRing(['a', 'b', 'c'])
+        moved = [key for key in range(2000) if before.get(key) != after.get(key)]
+        self.assertTrue(all(after.get(key) == 'c' for key in moved))
+        self.assertLess(len(moved), 1000)
+        self.assertEqual([before.get(key) for key in range(50)], [HashRing(['b', 'a']).get(key) for key in range(50)])
+
+    def test_merge_newest(self):
+        results = [[(5, 1), (3, 1)], [(4, 2), (1, 2)], []]
+        self.assertEqual(merge_newest(results, 3, key=lambda item: item), [(5, 1), (4, 2), (3, 1)])
+
+    def test_scatter_keeps_shard_order(self):
+        self.assertEqual(scatter(lambda alias: alias.upper(), shards=['a', 'b', 'c']), ['A', 'B', 'C'])
+        self.assertEqual(scatter(lambda alias: alias, shards=['only']), ['only'])
+
+    @override_settings(POSTS_SHARDS=['default', 'posts_1'])
+    def test_router_only_migrates_post_tables_on_shards(self):
+        router = PostShardRouter()
+        self.assertTrue(router.allow_migrate('posts_1', 'posts', 'post'))
+        self.assertTrue(router.allow_migrate('posts_1', 'posts', 'posthashtag'))
+        self.assertFalse(router.allow_migrate('posts_1', 'auth', 'user'))
+        self.assertIsNone(router.allow_migrate('default', 'auth', 'user'))
+
+
+@skipUnless('posts_1' in settings.POSTS_SHARDS, 'run with POSTS_SHARDS=default,posts_1')
+@override_settings(POSTS_SHARDS=['default', 'posts_1'], FEEDS_PREWARM_ENABLED=False)
+class ShardMoveTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('mover', 'mover@example.com', 'test-password')
+        UserShard.objects.create(user_id=self.user.pk, shard='default')
+        for number in range(3):
+            Post.objects.using('default').create(user=self.user, message=f'Post {number}')
+
+    def posts_on(self, alias):
+        return Post.objects.using(alias).filter(user_id=self.user.pk).count()
+
+    def test_router_follows_the_placement(self):
+        router = PostShardRouter()
+        self.assertEqual(router.db_for_write(Post, instance=Post(user_id=self.user.pk)), 'default')
+        list(move_user_posts(self.user.pk, 'posts_1'))
+        self.assertEqual(router.db_for_write(Post, instance=Post(user_id=self.user.pk)), 'posts_1')
+        self.assertEqual(router.db_for_read(User, instance=Post.objects.using('posts_1').first()), 'default')
+
+    def test_posts_written_with_a_stale_placement_are_swept(self):
+        self.assertEqual(sum(move_user_posts(self.user.pk, 'posts_1', batch_size=2)), 3)
+        self.assertEqual((self.posts_on('default'), self.posts_on('posts_1')), (0, 3))
+        self.assertEqual(shard_for_user(self.user.pk), 'posts_1')
+
+        # a worker that still caches the old placement
+        Post.objects.using('default').create(user=self.user, message='Late post')
+        placement = UserShard.objects.get(user_id=self.user.pk)
+        self.assertEqual(placement.moved_from, 'default')
+        self.assertEqual(sum(sweep_user_posts(placement)), 1)
+        self.assertEqual((self.posts_on('default'), self.posts_on('posts_1')), (0, 4))
+        self.assertEqual(UserShard.objects.get(user_id=self.user.pk).moved_from, '')
+
+    def test_rebalance_sweeps_once_placements_expired(self):
+        call_command('rebalance_shards', user='mover', to='posts_1', no_wait=True, stdout=open('/dev/null', 'w'))
+        Post.objects.using('default').create(user=self.user, message='Late post')
+
+        # not due yet, the late post stays until the cached placements expire
+        call_command('rebalance_shards', stdout=open('/dev/null', 'w'))
+        self.assertEqual(self.posts_on('default'), 1)
+
+        UserShard.objects.filter(user_id=self.user.pk).update(moved_at=timezone.now() - timedelta(hours=1))
+        call_command('rebalance_shards', user='mover', to='posts_1', stdout=open('/dev/null', 'w'))
+        self.assertEqual((self.posts_on('default'), self.posts_on('posts_1')), (0, 4))
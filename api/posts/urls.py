@@ -4,4 +4,9 @@ from . import views
 urlpatterns = [
     path('create/', views.create_post, name='create_post'),
     path('timeline/<int:user_id>/', views.user_timeline, name='user_timeline'),
+    path('tag/<str:tag>/', views.tag_timeline, name='tag_timeline'),
+    path('trending/', views.trending, name='trending'),
+    path('notifications/', views.notifications, name='notifications'),
+    path('export/', views.export_posts, name='export_posts'),
+    path('stream/', views.post_stream, name='post_stream'),
 ]
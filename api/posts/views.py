@@ -2,9 +2,31 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from .models import Post
+from django.conf import settings
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from django.template.defaultfilters import pluralize
+from django.template.loader import render_to_string
+from .models import Hashtag, Notification, Post, PostArchive
+from .archive import decode_cursor, encode_cursor, tag_page, timeline_page
+from .hashtags import record_hashtags, trending_hashtags
+from .mentions import attach_posts, record_mentions
+from api.users.models import UserProfile
+from api.metrics import posts_created
+from api.ratelimit import ratelimit
+from api.streaming import render_streamed
+from .exports import EXPORT_FORMATS, export_stream
+from .events import event_stream, get_broker, publish_new_post
+from .feeds import invalidate_counters, invalidate_feeds
+from .sharding import assign_shard, attach_users, merge_newest, scatter, shard_aliases, user_posts
+import logging
+
+logger = logging.getLogger('api.posts')
 
 @login_required
+@ratelimit('create_post')
 def create_post(request):
     """
     Handle post creation for authenticated users
@@ -19,7 +41,15 @@ def create_post(request):
     if request.method == 'POST':
         message = request.POST.get('message')
         if message:
-            Post.objects.create(user=request.user, message=message)
+            shard = assign_shard(request.user.pk)
+            with transaction.atomic(), transaction.atomic(using=shard):
+                post = Post.objects.using(shard).create(user=request.user, message=message)
+                record_hashtags(post)
+                recipient_ids = record_mentions(post)
+                transaction.on_commit(lambda: publish_new_post(post))
+                transaction.on_commit(invalidate_feeds)
+                transaction.on_commit(lambda: invalidate_counters(recipient_ids))
+            posts_created.inc()
             messages.success(request, 'Post created successfully!')
         else:
             messages.error(request, 'Post cannot be empty.')
@@ -27,21 +57,192 @@ def create_post(request):
 
 def user_timeline(request, user_id):
     """
-    Display user's timeline with all their posts
+    Display one page of a user's timeline, spanning hot and archived posts
+    
+    The profile header is streamed before the post count and the page of
+    posts are queried (``POSTS_TIMELINE_STREAMING``), so the browser can
+    start rendering while the database works.
     
     Args:
         request: Django request object
         user_id: ID of the user whose timeline to display
     
     Returns:
-        HttpResponse: User timeline template
+        StreamingHttpResponse: User timeline template, HttpResponse when streaming is off
     """
 
     user = get_object_or_404(User, id=user_id)
-    posts = Post.objects.filter(user=user)
+    cursor = decode_cursor(request.GET.get('cursor'))
+    is_own_profile = request.user == user if request.user.is_authenticated else False
+
+    def post_count():
+        count = user_posts(user.pk).count() + user_posts(user.pk, PostArchive).count()
+        return f'{count} post{pluralize(count)}'
+
+    def post_list():
+        posts, next_cursor = timeline_page(user, cursor=cursor, limit=settings.POSTS_TIMELINE_PAGE_SIZE)
+        return render_to_string('timeline/posts.html', {
+            'profile_user': user,
+            'posts': posts,
+            'next_cursor': next_cursor,
+            'is_paged': cursor is not None,
+            'is_own_profile': is_own_profile
+        }, request)
+
     context = {
         'profile_user': user,
+        'is_own_profile': is_own_profile
+    }
+    return render_streamed(
+        request, 'timeline.html', context,
+        deferred={'post_count': post_count, 'post_list': post_list},
+        stream=settings.POSTS_TIMELINE_STREAMING
+    )
+
+def tag_timeline(request, tag):
+    """
+    Display the most recent posts using a hashtag, archived posts included
+    
+    Args:
+        request: Django request object
+        tag: Hashtag name without the leading ``#``
+    
+    Returns:
+        HttpResponse: Tag timeline template
+    """
+
+    hashtag = get_object_or_404(Hashtag, name=tag.lower())
+    limit = settings.POSTS_TIMELINE_PAGE_SIZE
+    cursor = decode_cursor(request.GET.get('cursor'))
+
+    links = merge_newest(
+        scatter(lambda alias: tag_page(hashtag, alias, cursor=cursor, limit=limit + 1)),
+        limit + 1,
+        key=lambda link: (link.timestamp, link.post_id)
+    )
+    posts = attach_users([link.post for link in links[:limit]])
+    context = {
+        'hashtag': hashtag,
         'posts': posts,
-        'is_own_profile': request.user == user if request.user.is_authenticated else False
+        'next_cursor': encode_cursor(posts[-1]) if len(links) > limit else None,
+        'is_paged': cursor is not None
+    }
+    return render(request, 'tag.html', context)
+
+def trending(request):
+    """
+    Display the hashtags trending over the configured sliding window
+    
+    Args:
+        request: Django request object
+    
+    Returns:
+        HttpResponse: Trending hashtags template
+    """
+
+    context = {
+        'trending': trending_hashtags(),
+        'window_hours': settings.HASHTAG_TRENDING_WINDOW_HOURS
     }
-    return render(request, 'timeline.html', context)
+    return render(request, 'trending.html', context)
+
+@login_required
+def notifications(request):
+    """
+    Display the current user's latest notifications and mark them as read
+    
+    Args:
+        request: Django request object
+    
+    Returns:
+        HttpResponse: Notifications template
+    """
+
+    items = attach_posts(list(
+        Notification.objects.filter(recipient=request.user)
+        .select_related('actor')[:settings.NOTIFICATIONS_PAGE_SIZE]
+    ))
+    with transaction.atomic():
+        Notification.objects.filter(recipient=request.user, is_read=False).update(is_read=True)
+        UserProfile.objects.filter(user=request.user).update(unread_notifications=0)
+        transaction.on_commit(lambda: invalidate_counters([request.user.pk]))
+    return render(request, 'notifications.html', {'notifications': items})
+
+@login_required
+def export_posts(request):
+    """
+    Stream the current user's posts, or every post for staff, as NDJSON or CSV
+
+    Query params:
+        format: ``ndjson`` (default) or ``csv``
+        gzip: ``1`` to gzip the output on the fly
+        all: ``1`` to export every user's posts (staff only)
+
+    Args:
+        request: Django request object
+
+    Returns:
+        StreamingHttpResponse: Export file download
+    """
+
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'Unsupported export format: {export_format}')
+
+    if request.GET.get('all') == '1':
+        if not request.user.is_staff:
+            logger.warning(f'Non-staff full export attempt by {request.user.username}')
+            return HttpResponseForbidden('Only staff can export all posts.')
+        querysets = [model.objects.using(alias) for alias in shard_aliases() for model in (Post, PostArchive)]
+        filename = f'posts.{export_format}'
+    else:
+        querysets = [user_posts(request.user.pk), user_posts(request.user.pk, PostArchive)]
+        filename = f'{request.user.username}-posts.{export_format}'
+
+    compress = request.GET.get('gzip') == '1'
+    chunks, content_type = export_stream(
+        querysets,
+        export_format=export_format,
+        compress=compress,
+        batch_size=settings.POSTS_EXPORT_BATCH_SIZE
+    )
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    logger.info(f'Post export ({export_format}) started by {request.user.username}')
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+async def post_stream(request):
+    """
+    Push newly created posts to the client as Server-Sent Events
+
+    Only served when running under ASGI (``api/asgi.py``), a WSGI worker would
+    be tied up for the whole connection so it answers 204, which tells the
+    browser's EventSource to stop reconnecting.
+
+    Args:
+        request: Django request object
+
+    Returns:
+        StreamingHttpResponse: ``text/event-stream`` response
+    """
+
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    stream = event_stream(
+        get_broker(),
+        heartbeat=settings.POSTS_STREAM_HEARTBEAT,
+        max_buffer=settings.POSTS_STREAM_BUFFER_SIZE,
+        max_age=settings.POSTS_STREAM_MAX_AGE
+    )
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,132 @@
+# profiling.py
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from asyncio import iscoroutinefunction
+from pathlib import Path
+from django.conf import settings
+
+PROFILE_PARAM = '__profile'
+PROFILE_HEADER = 'X-Profile'
+CAPTURE_NAME_RE = re.compile(r'^[\w.-]+$')
+
+_capture_ids = itertools.count(1)
+
+def capture_dir():
+    directory = Path(settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+def list_captures():
+    """
+    List saved captures, newest first
+
+    Returns:
+        list: dicts with ``name``, ``created`` (epoch seconds), ``has_stats`` and ``size``
+    """
+
+    captures = []
+    for report in capture_dir().glob('*.txt'):
+        stats_file = report.with_suffix('.prof')
+        stat = report.stat()
+        captures.append({
+            'name': report.stem,
+            'created': stat.st_mtime,
+            'has_stats': stats_file.exists(),
+            'size': stat.st_size + (stats_file.stat().st_size if stats_file.exists() else 0),
+        })
+    return sorted(captures, key=lambda capture: capture['created'], reverse=True)
+
+def capture_path(name, extension):
+    """Resolve a capture file, or None if the name is invalid or missing"""
+    if not CAPTURE_NAME_RE.match(name) or extension not in ('prof', 'txt'):
+        return None
+    path = capture_dir() / f'{name}.{extension}'
+    return path if path.exists() else None
+
+def _trim_captures(keep):
+    for capture in list_captures()[keep:]:
+        for extension in ('prof', 'txt'):
+            try:
+                os.remove(capture_dir() / f'{capture["name"]}.{extension}')
+            except FileNotFoundError:
+                pass
+
+def save_capture(view_name, profiler, memory_snapshot=None):
+    """
+    Write a capture to the on-disk ring buffer, dropping the oldest ones
+
+    Args:
+        view_name: Name of the profiled view
+        profiler: Finished ``cProfile.Profile``
+        memory_snapshot: Optional ``tracemalloc.Snapshot``
+
+    Returns:
+        str: Capture name
+    """
+
+    slug = re.sub(r'[^\w-]+', '-', view_name).strip('-') or 'view'
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(_capture_ids)}-{slug}'
+    directory = capture_dir()
+    profiler.dump_stats(directory / f'{name}.prof')
+
+    report = io.StringIO()
+    report.write(f'Profile of {view_name}\n\n')
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(settings.PROFILING_TOP_FUNCTIONS)
+    if memory_snapshot is not None:
+        report.write('\nTop allocations by line\n\n')
+        for stat in memory_snapshot.statistics('lineno')[:settings.PROFILING_TOP_ALLOCATIONS]:
+            report.write(f'{stat}\n')
+    (directory / f'{name}.txt').write_text(report.getvalue())
+
+    _trim_captures(settings.PROFILING_MAX_CAPTURES)
+    return name
+
+class ProfilingMiddleware:
+    """
+    Run a single view under cProfile (and optionally tracemalloc) on demand
+
+    Triggered by staff users with ``?__profile=1`` or an ``X-Profile: 1``
+    header, ``mem`` instead of ``1`` also records the top allocations. Other
+    requests only pay for a query string and header lookup. Keep it last in
+    ``MIDDLEWARE`` so every other ``process_view`` hook still runs.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = request.GET.get(PROFILE_PARAM) or request.headers.get(PROFILE_HEADER)
+        if not mode or not request.user.is_staff or iscoroutinefunction(view_func):
+            return None
+
+        trace_memory = mode == 'mem' and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        memory_snapshot = None
+        try:
+            response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+            # template responses render lazily, include that in the profile
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                profiler.runcall(response.render)
+            # streamed pages do most of their work while being iterated
+            elif response.streaming and not response.is_async:
+                response.streaming_content = profiler.runcall(list, response.streaming_content)
+        finally:
+            if trace_memory:
+                memory_snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            view_name = request.resolver_match.view_name if request.resolver_match else view_func.__name__
+            name = save_capture(view_name, profiler, memory_snapshot)
+
+        response['X-Profile-Capture'] = name
+        return response
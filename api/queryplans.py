@@ -0,0 +1,161 @@
+# queryplans.py
+import re
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from api.posts.feeds import invalidate_feeds
+from api.posts.models import Post
+from api.users.models import UserProfile
+
+CHECKED_TABLES = ('posts_post', 'users_userprofile')
+
+def seed_plan_data(users=20, posts_per_user=50):
+    """
+    Create enough users, profiles and posts for the planner to pick indexes
+
+    Returns:
+        dict: ``user`` (a verified user with password ``plan-password``) and
+        ``profile`` (an unverified profile with a fresh verification token)
+    """
+
+    now = timezone.now()
+    created = []
+    for index in range(users):
+        user = User(username=f'planuser_{index}', email=f'planuser_{index}@example.com', is_active=True)
+        user.set_unusable_password()
+        created.append(user)
+    User.objects.bulk_create(created)
+    created = list(User.objects.filter(username__startswith='planuser_').order_by('id'))
+
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, is_email_verified=index > 0)
+        for index, user in enumerate(created)
+    ])
+    Post.objects.bulk_create([
+        Post(user=user, message=f'Plan check post {number}', timestamp=now - timedelta(minutes=number * users + index))
+        for index, user in enumerate(created)
+        for number in range(posts_per_user)
+    ])
+
+    user = created[1]
+    user.set_password('plan-password')
+    user.save(update_fields=['password'])
+    profile = created[0].profile
+    profile.generate_new_verification_token()
+    return {'user': user, 'profile': profile}
+
+def hot_view_requests(fixtures):
+    """
+    The hot views and the request that exercises each of them
+
+    Returns:
+        list: ``(name, method, url, data, login_user)`` tuples
+    """
+
+    user = fixtures['user']
+    return [
+        ('home_view', 'get', reverse('home'), None, user),
+        ('user_timeline', 'get', reverse('user_timeline', args=[user.id]), None, user),
+        ('verify_email', 'get', reverse('verify_email', args=[fixtures['profile'].email_verification_token]), None, None),
+        ('login_view', 'post', reverse('login'), {'username': user.username, 'password': 'plan-password'}, None),
+    ]
+
+@contextmanager
+def capture_selects(conn=connection):
+    """Collect the raw ``(sql, params)`` of every SELECT run inside the block"""
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with conn.execute_wrapper(record):
+        yield queries
+
+def explain(sql, params, conn=connection):
+    """
+    Return the plan of a query as a list of text lines
+
+    Uses ``EXPLAIN QUERY PLAN`` on SQLite and ``EXPLAIN`` on PostgreSQL. On
+    PostgreSQL sequential scans are disabled for the EXPLAIN so that a seq
+    scan in the plan means no usable index exists, whatever the table size.
+    """
+
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+def plan_violations(sql, plan, vendor, tables=CHECKED_TABLES):
+    """
+    Find full table scans and temporary sorts of the checked tables in a plan
+
+    Returns:
+        list: Offending plan lines
+    """
+
+    violations = []
+    mentions_table = any(re.search(rf'\b"?{table}"?\b', sql) for table in tables)
+    for line in plan:
+        if vendor == 'postgresql':
+            if any(re.search(rf'Seq Scan on {table}\b', line) for table in tables):
+                violations.append(line.strip())
+            elif mentions_table and re.match(r'\s*(->\s*)?(Incremental )?Sort\b', line):
+                violations.append(line.strip())
+        else:
+            if any(re.fullmatch(rf'SCAN (TABLE )?{table}( AS \w+)?', line.strip()) for table in tables):
+                violations.append(line.strip())
+            elif mentions_table and 'USE TEMP B-TREE' in line:
+                violations.append(line.strip())
+    return violations
+
+def is_allowlisted(sql, allowlist=None):
+    patterns = settings.QUERY_PLAN_ALLOWLIST if allowlist is None else allowlist
+    return any(re.search(pattern, sql) for pattern in patterns)
+
+def check_view_plans(method, url, data=None, login_user=None, allowlist=None):
+    """
+    Request a view and check the plan of every SELECT it ran
+
+    Returns:
+        list: ``(sql, violations)`` tuples for each offending query
+    """
+
+    client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+    # cached feeds would hide the queries, and prewarm jobs would race the check
+    with override_settings(FEEDS_PREWARM_ENABLED=False):
+        if login_user is not None:
+            client.force_login(login_user)
+        invalidate_feeds()
+        with capture_selects() as queries:
+            response = getattr(client, method)(url, data or {})
+            # streamed pages run their deferred queries while being iterated
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+    failures = []
+    for sql, params in queries:
+        if is_allowlisted(sql, allowlist):
+            continue
+        violations = plan_violations(sql, explain(sql, params), connection.vendor)
+        if violations:
+            failures.append((sql, violations))
+    return failures
+
+class QueryPlanTestMixin:
+    """TestCase mixin asserting that a view's queries are served by indexes"""
+
+    def assertQueryPlansIndexed(self, method, url, data=None, login_user=None, allowlist=None):
+        failures = check_view_plans(method, url, data=data, login_user=login_user, allowlist=allowlist)
+        if failures:
+            details = '\n\n'.join(f'{sql}\n  -> ' + '\n  -> '.join(violations) for sql, violations in failures)
+            self.fail(f'{len(failures)} queries of {url} scan or sort without an index:\n\n{details}')
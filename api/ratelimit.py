@@ -0,0 +1,142 @@
+# ratelimit.py
+import logging
+import math
+import re
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from api.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# a bucket refills capacity / REFILL_STEPS tokens every period / REFILL_STEPS
+REFILL_STEPS = 10
+
+throttled_requests = REGISTRY.counter(
+    'ratelimit_throttled_total', 'Requests rejected by the rate limiter', ['scope']
+)
+
+def parse_rate(rate):
+    """
+    Parse a rate such as ``10/m`` or ``100/5m``
+
+    Returns:
+        tuple: (capacity: int, period: int seconds)
+    """
+
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f'Invalid rate: {rate}')
+    capacity, multiplier, unit = match.groups()
+    return int(capacity), int(multiplier or 1) * PERIODS[unit]
+
+def client_ip(request):
+    """
+    Return the client address, as seen by the outermost trusted proxy
+
+    Each proxy appends the address it received the request from to
+    ``RATELIMIT_IP_HEADER``, so only the last ``RATELIMIT_TRUSTED_PROXIES``
+    entries can be trusted, anything left of them is sent by the client.
+    """
+
+    header = settings.RATELIMIT_IP_HEADER
+    proxies = settings.RATELIMIT_TRUSTED_PROXIES
+    if header and proxies > 0 and request.META.get(header):
+        addresses = [address.strip() for address in request.META[header].split(',')]
+        if len(addresses) >= proxies and addresses[-proxies]:
+            return addresses[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+def bucket_identity(request, key):
+    """Identify the caller for a bucket keyed by ``user``, ``ip`` or ``user_or_ip``"""
+    if key in ('user', 'user_or_ip') and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+def _carried_level(cache, prefix, step_index, capacity):
+    """Level of a bucket at the start of a step, from the last step that saw a request"""
+    keys = [f'{prefix}:{step_index - back}' for back in range(1, REFILL_STEPS + 1)]
+    levels = cache.get_many(keys)
+    for back, key in enumerate(keys, 1):
+        if key in levels:
+            return max(0, levels[key] - back * capacity)
+    # idle for a whole period, the bucket is full again
+    return 0
+
+def take_token(scope, identity, capacity, period, now=None):
+    """
+    Take one token from a bucket holding ``capacity`` tokens per ``period``
+
+    The bucket refills in ``REFILL_STEPS`` steps per period, so a burst
+    drains it and the next requests are spread at the refill rate, there is
+    no window boundary at which a full capacity is granted again. Levels are
+    counted in 1/``REFILL_STEPS`` token units in one cache counter per step:
+    a request costs a single ``incr`` round-trip, the first request of a step
+    carries the level of the last step over, minus what was refilled since.
+    Rejected requests give their token back.
+
+    Returns:
+        tuple: (allowed: bool, retry_after: int seconds, 0 when allowed)
+    """
+
+    now = time.time() if now is None else now
+    step = period / REFILL_STEPS
+    step_index = int(now // step)
+    prefix = f'ratelimit:{scope}:{identity}'
+    cache_key = f'{prefix}:{step_index}'
+    cache = caches[settings.RATELIMIT_CACHE]
+    try:
+        level = cache.incr(cache_key, REFILL_STEPS)
+    except ValueError:
+        cache.add(cache_key, _carried_level(cache, prefix, step_index, capacity), timeout=math.ceil(period + step) + 1)
+        level = cache.incr(cache_key, REFILL_STEPS)
+
+    full = capacity * REFILL_STEPS
+    if level <= full:
+        return True, 0
+    cache.decr(cache_key, REFILL_STEPS)
+    steps_needed = math.ceil((level - full) / capacity)
+    return False, max(1, math.ceil((step_index + steps_needed) * step - now))
+
+def ratelimit(scope, methods=('POST',), on_throttle=None):
+    """
+    Rate limit a view with the bucket configured in ``RATELIMITS[scope]``
+
+    Args:
+        scope: Key of the ``RATELIMITS`` setting
+        methods: HTTP methods that consume tokens, None for every method
+        on_throttle: Optional callable receiving the request when it is rejected
+
+    Returns:
+        function: View decorator answering 429 with ``Retry-After`` once the bucket is empty
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            config = settings.RATELIMITS.get(scope)
+            if not settings.RATELIMIT_ENABLED or config is None or (methods and request.method not in methods):
+                return view_func(request, *args, **kwargs)
+
+            capacity, period = parse_rate(config['rate'])
+            identity = bucket_identity(request, config.get('key', 'user_or_ip'))
+            allowed, retry_after = take_token(scope, identity, capacity, period)
+            if allowed:
+                return view_func(request, *args, **kwargs)
+
+            logger.warning(f'Rate limit exceeded for {scope} by {identity}')
+            throttled_requests.inc(scope=scope)
+            if on_throttle:
+                on_throttle(request)
+            response = HttpResponse(
+                'Too many requests. Please try again later.', status=429, content_type='text/plain'
+            )
+            response['Retry-After'] = str(retry_after)
+            return response
+        return wrapped
+    return decorator
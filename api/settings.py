@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'api.urls'
@@ -70,6 +73,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'api.posts.context_processors.counters',
             ],
         },
     },
@@ -95,6 +99,24 @@ DATABASES = {
     }
 }
 
+# Posts Sharding Config (database aliases holding posts, empty for a single database).
+# Each alias reads <ALIAS>_DATABASE_URL, defaulting to a local SQLite file. Append new
+# shards at the end, a shard's position sets its post id range.
+POSTS_SHARDS = env.list('POSTS_SHARDS', default=[])
+for _alias in POSTS_SHARDS:
+    if _alias not in DATABASES:
+        DATABASES[_alias] = env.db_url(f'{_alias.upper()}_DATABASE_URL', default=f'sqlite:///{BASE_DIR / _alias}.sqlite3')
+DATABASE_ROUTERS = ['api.posts.sharding.PostShardRouter']
+POSTS_SHARD_REPLICAS = 100
+POSTS_SHARD_CACHE_SECONDS = 60
+POSTS_SHARD_ID_BITS = 40
+POSTS_SHARD_SCATTER_WORKERS = 8
+POSTS_SHARD_MOVE_BATCH_SIZE = 500
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://')
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -202,6 +224,84 @@ EMAIL_USE_TLS = env('EMAIL_USE_TLS')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
 
+# Post Storage Config
+POSTS_TIMELINE_PAGE_SIZE = 20
+POSTS_HOT_WINDOW_DAYS = 90
+POSTS_ARCHIVE_BATCH_SIZE = 1000
+POSTS_TIMELINE_STREAMING = env.bool('POSTS_TIMELINE_STREAMING', default=True)
+
+# Hashtag Config
+HASHTAG_BUCKET_SECONDS = 3600
+HASHTAG_TRENDING_WINDOW_HOURS = 24
+HASHTAG_TRENDING_LIMIT = 10
+HASHTAG_TRENDING_REFRESH_SECONDS = 60
+HASHTAG_COUNT_RETENTION_HOURS = 24 * 7
+
+# Notification Config
+NOTIFICATIONS_PAGE_SIZE = 50
+NOTIFICATION_DIGEST_BATCH_SIZE = 100
+NOTIFICATION_DIGEST_MAX_MENTIONS = 20
+SITE_URL = env('SITE_URL', default='http://127.0.0.1:8000')
+
+# Post Export Config
+POSTS_EXPORT_BATCH_SIZE = 1000
+
+# Live Feed (Server-Sent Events) Config
+POSTS_EVENT_BROKER = 'api.posts.events.InProcessBroker'
+POSTS_STREAM_HEARTBEAT = 15
+POSTS_STREAM_BUFFER_SIZE = 32
+POSTS_STREAM_MAX_AGE = 300
+
+# Admin Config
+ADMIN_EXACT_COUNT_THRESHOLD = 10000
+ADMIN_ACTION_CHUNK_SIZE = 500
+
+# Metrics Config
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+METRICS_MULTIPROC_DIR = env('METRICS_MULTIPROC_DIR', default='')
+METRICS_FLUSH_INTERVAL = 5
+
+# Profiling Config
+PROFILING_DIR = LOGS_DIR / 'profiles'
+PROFILING_MAX_CAPTURES = 20
+PROFILING_TOP_FUNCTIONS = 50
+PROFILING_TOP_ALLOCATIONS = 25
+
+# Query Plan Checker Config (regexes of SQL allowed to scan/sort)
+QUERY_PLAN_ALLOWLIST = []
+
+# Rate Limit Config (key: user, ip or user_or_ip)
+RATELIMIT_ENABLED = env.bool('RATELIMIT_ENABLED', default=True)
+RATELIMIT_CACHE = 'default'
+RATELIMIT_IP_HEADER = env('RATELIMIT_IP_HEADER', default=None)
+RATELIMIT_TRUSTED_PROXIES = env.int('RATELIMIT_TRUSTED_PROXIES', default=1)
+RATELIMITS = {
+    'create_post': {'rate': '10/m', 'key': 'user'},
+    'register': {'rate': '5/h', 'key': 'ip'},
+    'resend_verification': {'rate': '3/h', 'key': 'ip'},
+    'login': {'rate': '10/m', 'key': 'ip'},
+}
+
+# Account Deletion Config
+ACCOUNT_DELETION_BATCH_SIZE = 500
+
+# Feed Cache Config (prewarmed on login by a bounded thread pool)
+FEEDS_CACHE_SECONDS = 30
+FEEDS_RECENT_POSTS = 10
+FEEDS_PREWARM_ENABLED = env.bool('FEEDS_PREWARM_ENABLED', default=True)
+FEEDS_PREWARM_WORKERS = env.int('FEEDS_PREWARM_WORKERS', default=2)
+FEEDS_PREWARM_QUEUE_DEPTH = env.int('FEEDS_PREWARM_QUEUE_DEPTH', default=100)
+
+# Compression Config (gzip, plus br when the brotli package is installed)
+COMPRESSION_ENABLED = env.bool('COMPRESSION_ENABLED', default=True)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CONTENT_TYPES = [
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/x-ndjson',
+]
+COMPRESSION_STREAMING_TYPES = ['text/html']
+
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
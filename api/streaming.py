@@ -0,0 +1,57 @@
+# streaming.py
+import re
+import secrets
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+def _split(html, token):
+    """Alternating literal chunks and deferred names, literal chunks at even indexes"""
+    return re.split(rf'<!--{token}:(\w+)-->', html)
+
+def _chunks(parts, deferred):
+    for index, part in enumerate(parts):
+        chunk = part if index % 2 == 0 else deferred[part]()
+        if chunk:
+            yield chunk
+
+async def _achunks(parts, deferred):
+    for index, part in enumerate(parts):
+        chunk = part if index % 2 == 0 else await sync_to_async(deferred[part])()
+        if chunk:
+            yield chunk
+
+def render_streamed(request, template_name, context, deferred, stream=True):
+    """
+    Render a template whose slow sections are only computed while streaming
+
+    The template is rendered once with a placeholder for every ``deferred``
+    name, everything up to the first placeholder is sent right away and each
+    callable runs (and its HTML is sent) in document order. Deferred names can
+    only be output with ``{{ name }}``, not used in tags or filters, and
+    callables whose placeholder is not rendered are never called.
+
+    Args:
+        request: Django request object
+        template_name: Template to render
+        context: Template context
+        deferred: Mapping of context name to a callable returning HTML
+        stream: False renders everything up front into a regular response
+
+    Returns:
+        StreamingHttpResponse or HttpResponse: Rendered page
+    """
+
+    token = secrets.token_hex(8)
+    placeholders = {name: mark_safe(f'<!--{token}:{name}-->') for name in deferred}
+    parts = _split(render_to_string(template_name, {**context, **placeholders}, request), token)
+
+    if not stream:
+        return HttpResponse(''.join(_chunks(parts, deferred)))
+    # under ASGI a sync iterator would be buffered whole before being sent
+    chunks = _achunks(parts, deferred) if isinstance(request, ASGIRequest) else _chunks(parts, deferred)
+    response = StreamingHttpResponse(chunks)
+    response['X-Accel-Buffering'] = 'no'
+    return response
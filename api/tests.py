@@ -0,0 +1,402 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import zlib
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from api.compression import CompressionMiddleware, negotiate_encoding
+from api.loadtest import DEFAULT_SCENARIO, build_plan, cleanup_accounts, load_scenario, prepare_accounts
+from api.metrics import REGISTRY, Registry, render
+from api.posts.tests import serial_scatter
+from api.profiling import capture_path, list_captures
+from api.queryplans import QueryPlanTestMixin, hot_view_requests, seed_plan_data
+from api.ratelimit import client_ip, take_token
+from api.streaming import render_streamed
+from api.users.models import UserProfile
+
+
+def gunzip_chunks(chunks):
+    """Decompress gzip chunks one by one, as a browser does while they arrive"""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    return [decompressor.decompress(chunk) for chunk in chunks]
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.requests = self.registry.counter('requests_total', 'Requests', ['view'])
+        self.latency = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        self.depth = self.registry.gauge('queue_depth', 'Queue depth')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def sibling(self, pid, start, requests):
+        """Write the snapshot of another worker process"""
+        registry = Registry()
+        registry.counter('requests_total', 'Requests', ['view']).inc(requests, view='home')
+        registry.gauge('queue_depth', 'Queue depth').set(5)
+        with open(os.path.join(self.directory, f'{pid}-{start}.json'), 'w') as snapshot_file:
+            json.dump(registry.snapshot(), snapshot_file)
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    def samples(self, name):
+        return dict((tuple(key), value) for key, value in self.registry.collect(self.directory)[name]['samples'])
+
+    def test_render(self):
+        self.requests.inc(view='home')
+        self.requests.inc(2, view='say "hi"')
+        self.latency.observe(0.05)
+        self.latency.observe(0.5)
+        self.depth.set_function(lambda: 3)
+        text = render(self.registry.collect())
+        self.assertIn('# TYPE requests_total counter\nrequests_total{view="home"} 1\n', text)
+        self.assertIn('requests_total{view="say \\"hi\\""} 2', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1\nlatency_seconds_bucket{le="1.0"} 2\n'
+                      'latency_seconds_bucket{le="+Inf"} 2\nlatency_seconds_sum 0.55\nlatency_seconds_count 2', text)
+        self.assertIn('# TYPE queue_depth gauge\nqueue_depth 3\n', text)
+
+    def test_sums_live_workers(self):
+        self.requests.inc(view='home')
+        self.depth.set(1)
+        self.sibling(os.getppid(), 1, requests=4)
+        self.assertEqual(self.samples('requests_total'), {('home',): 5})
+        self.assertEqual(self.samples('queue_depth'), {(): 6})
+
+    def test_dead_workers_are_retained_without_gauges(self):
+        self.requests.inc(view='home')
+        dead_pid = self.dead_pid()
+        self.sibling(dead_pid, 1, requests=4)
+        self.assertEqual(self.samples('requests_total'), {('home',): 5})
+        self.assertEqual(self.samples('queue_depth'), {})
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.lock', 'retired.json'])
+
+        # the next dead worker adds to the retained total
+        self.sibling(dead_pid, 2, requests=2)
+        self.assertEqual(self.samples('requests_total'), {('home',): 7})
+
+    def test_reused_pid_keeps_both_totals(self):
+        self.sibling(os.getppid(), 1, requests=4)
+        self.sibling(os.getppid(), 2, requests=3)
+        self.assertEqual(self.samples('requests_total'), {('home',): 7})
+        self.assertNotIn(f'{os.getppid()}-1.json', os.listdir(self.directory))
+
+    def test_retire_on_exit(self):
+        self.requests.inc(3, view='home')
+        self.registry.flush(self.directory)
+        self.registry.retire(self.directory)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.lock', 'retired.json'])
+        self.assertEqual(Registry().collect(self.directory)['requests_total']['samples'], [[['home'], 3]])
+
+    def test_gauges(self):
+        families = REGISTRY.collect()
+        self.assertEqual(families['sse_subscribers']['samples'], [[[], 0]])
+        self.assertEqual(families['feed_prewarm_queue_depth']['samples'], [[[], 0]])
+
+
+@override_settings(COMPRESSION_ENABLED=True)
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+
+    def compress(self, response, request=None):
+        return CompressionMiddleware(lambda request: response)(request or self.request)
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate', available=('br', 'gzip')), 'gzip')
+        self.assertEqual(negotiate_encoding('gzip;q=0.5, br', available=('br', 'gzip')), 'br')
+        self.assertEqual(negotiate_encoding('br;q=0, *;q=0.1', available=('br', 'gzip')), 'gzip')
+        self.assertIsNone(negotiate_encoding('identity', available=('br', 'gzip')))
+        self.assertIsNone(negotiate_encoding('gzip;q=0', available=('gzip',)))
+        self.assertIsNone(negotiate_encoding('', available=('gzip',)))
+
+    def test_compresses_large_html(self):
+        response = HttpResponse('<p>Hello</p>' * 200)
+        response['ETag'] = '"abc"'
+        response = self.compress(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(b''.join(gunzip_chunks([response.content])), b'<p>Hello</p>' * 200)
+
+    def test_leaves_small_and_opaque_bodies_alone(self):
+        self.assertFalse(self.compress(HttpResponse('<p>Hi</p>')).has_header('Content-Encoding'))
+        image = HttpResponse(b'x' * 4096, content_type='image/png')
+        self.assertFalse(self.compress(image).has_header('Content-Encoding'))
+        no_transform = HttpResponse('<p>Hello</p>' * 200)
+        no_transform['Cache-Control'] = 'no-transform'
+        self.assertFalse(self.compress(no_transform).has_header('Content-Encoding'))
+
+    def test_streamed_chunks_are_flushed_as_they_come(self):
+        produced = []
+
+        def body():
+            for chunk in (b'<header>', b'<main>', b'</main>'):
+                produced.append(chunk)
+                yield chunk
+
+        response = self.compress(StreamingHttpResponse(body()))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        for expected in (b'<header>', b'<main>', b'</main>'):
+            chunk = next(response.streaming_content)
+            # the chunk decodes to its HTML before the next one is produced
+            self.assertEqual(decompressor.decompress(chunk), expected)
+            self.assertEqual(produced[-1], expected)
+        decompressor.decompress(b''.join(response.streaming_content))
+        self.assertTrue(decompressor.eof)
+
+    def test_event_streams_are_not_compressed(self):
+        response = StreamingHttpResponse(iter([b'data: 1\n\n']), content_type='text/event-stream')
+        self.assertFalse(self.compress(response).has_header('Content-Encoding'))
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False, COMPRESSION_ENABLED=True, POSTS_TIMELINE_STREAMING=True)
+class StreamedRenderingTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('streamer', 'streamer@example.com', 'test-password')
+        UserProfile.objects.create(user=self.user, is_email_verified=True)
+
+    def test_deferred_sections_run_while_streaming(self):
+        calls = []
+
+        def section():
+            calls.append('section')
+            return '<p>late</p>'
+
+        request = RequestFactory().get('/')
+        response = render_streamed(request, 'timeline.html', {'profile_user': self.user}, {
+            'post_count': lambda: '0 posts', 'post_list': section
+        })
+        self.assertEqual(calls, [])
+        first = next(response.streaming_content)
+        self.assertIn(b'streamer', first)
+        self.assertEqual(calls, [])
+        self.assertIn(b'<p>late</p>', b''.join(response.streaming_content))
+        self.assertEqual(calls, ['section'])
+
+    def test_buffered_render_matches(self):
+        request = RequestFactory().get('/')
+        deferred = {'post_count': lambda: '0 posts', 'post_list': lambda: '<p>late</p>'}
+        response = render_streamed(request, 'timeline.html', {'profile_user': self.user}, deferred, stream=False)
+        self.assertIn(b'<p>late</p>', response.content)
+        self.assertNotIn(b'<!--', response.content.split(b'<p>late</p>')[0][-60:])
+
+    def test_gzipped_timeline_sends_the_header_first(self):
+        response = self.client.get(reverse('user_timeline', args=[self.user.id]), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        chunks = gunzip_chunks(response.streaming_content)
+        self.assertIn(b'streamer', chunks[0])
+        self.assertIn(b'0 posts', b''.join(chunks))
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False, PROFILING_MAX_CAPTURES=2)
+class ProfilingTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.enterContext(override_settings(PROFILING_DIR=self.directory.name))
+        self.addCleanup(self.directory.cleanup)
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'test-password', is_staff=True)
+        UserProfile.objects.create(user=self.staff, is_email_verified=True)
+        self.client.force_login(self.staff)
+
+    def profile(self, mode='1', **extra):
+        return self.client.get(reverse('trending'), {'__profile': mode}, **extra)
+
+    def test_staff_requests_are_captured(self):
+        response = self.profile()
+        name = response['X-Profile-Capture']
+        self.assertEqual([capture['name'] for capture in list_captures()], [name])
+        self.assertIn('Profile of trending', capture_path(name, 'txt').read_text())
+        self.assertIsNotNone(capture_path(name, 'prof'))
+        self.assertNotIn('Top allocations', capture_path(name, 'txt').read_text())
+
+        download = self.client.get(reverse('profile_capture_download', args=[name, 'prof']))
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(self.client.get(reverse('profile_capture_download', args=['..', 'txt'])).status_code, 404)
+
+    def test_memory_mode_and_header_trigger(self):
+        response = self.client.get(reverse('trending'), HTTP_X_PROFILE='mem')
+        self.assertIn('Top allocations by line', capture_path(response['X-Profile-Capture'], 'txt').read_text())
+
+    def test_streamed_pages_are_profiled_while_rendering(self):
+        response = self.client.get(reverse('user_timeline', args=[self.staff.pk]), {'__profile': '1'})
+        self.assertIn(b'staff', b''.join(response.streaming_content))
+        report = capture_path(response['X-Profile-Capture'], 'txt').read_text()
+        self.assertIn('streaming', report)
+
+    def test_only_the_newest_captures_are_kept(self):
+        names = [self.profile()['X-Profile-Capture'] for _ in range(3)]
+        self.assertEqual(sorted(capture['name'] for capture in list_captures()), sorted(names[1:]))
+
+    def test_others_are_not_profiled(self):
+        self.assertFalse(self.client.get(reverse('trending')).has_header('X-Profile-Capture'))
+        self.client.logout()
+        self.assertFalse(self.profile().has_header('X-Profile-Capture'))
+        self.assertEqual(list_captures(), [])
+        self.assertEqual(self.client.get(reverse('profile_captures')).status_code, 302)
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False)
+class HotViewQueryPlanTests(QueryPlanTestMixin, TestCase):
+    """The queries behind the hot views must be served by indexes"""
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = seed_plan_data()
+
+    def setUp(self):
+        cache.clear()
+        self.requests = {name: request for name, *request in hot_view_requests(self.fixtures)}
+
+    def assertViewIndexed(self, name):
+        method, url, data, login_user = self.requests[name]
+        self.assertQueryPlansIndexed(method, url, data=data, login_user=login_user)
+
+    @mock.patch('api.posts.feeds.scatter', serial_scatter)
+    def test_home_view(self):
+        self.assertViewIndexed('home_view')
+
+    def test_user_timeline(self):
+        self.assertViewIndexed('user_timeline')
+
+    def test_verify_email(self):
+        self.assertViewIndexed('verify_email')
+
+    def test_login_view(self):
+        self.assertViewIndexed('login_view')
+
+
+@override_settings(
+    RATELIMIT_ENABLED=True,
+    RATELIMITS={'login': {'rate': '2/m', 'key': 'ip'}},
+    FEEDS_PREWARM_ENABLED=False
+)
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('limited', 'limited@example.com', 'limited-password')
+        UserProfile.objects.create(user=user, is_email_verified=True)
+
+    def login(self, password='wrong-password', ip='10.0.0.1'):
+        return self.client.post(
+            reverse('login'), {'username': 'limited', 'password': password}, REMOTE_ADDR=ip
+        )
+
+    def test_bucket_refills_gradually(self):
+        self.assertEqual(take_token('test', 'ip:1', 2, 60, now=120.0), (True, 0))
+        self.assertEqual(take_token('test', 'ip:1', 2, 60, now=121.0), (True, 0))
+        # one token is back after half the period, refilled in 6 second steps
+        self.assertEqual(take_token('test', 'ip:1', 2, 60, now=122.0), (False, 28))
+        self.assertEqual(take_token('test', 'ip:1', 2, 60, now=149.0), (False, 1))
+        self.assertEqual(take_token('test', 'ip:1', 2, 60, now=150.0), (True, 0))
+        self.assertFalse(take_token('test', 'ip:1', 2, 60, now=150.5)[0])
+        # an idle period fills the bucket again
+        self.assertTrue(take_token('test', 'ip:1', 2, 60, now=300.0)[0])
+        self.assertTrue(take_token('test', 'ip:1', 2, 60, now=300.0)[0])
+
+    def test_no_double_burst_across_period_boundaries(self):
+        allowed = sum(take_token('test', 'ip:2', 10, 60, now=59.0)[0] for _ in range(10))
+        allowed += sum(take_token('test', 'ip:2', 10, 60, now=60.0)[0] for _ in range(10))
+        self.assertEqual(allowed, 11)
+
+    def test_empty_bucket_answers_429_with_retry_after(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 200)
+        response = self.login(password='limited-password')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 30)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_buckets_are_per_identity(self):
+        self.login()
+        self.login()
+        self.assertEqual(self.login().status_code, 429)
+        self.assertEqual(self.login(password='limited-password', ip='10.0.0.2').status_code, 302)
+
+    def test_get_does_not_take_tokens(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        self.assertEqual(self.login().status_code, 200)
+
+    @override_settings(RATELIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR', RATELIMIT_TRUSTED_PROXIES=1)
+    def test_forwarded_for_ignores_client_supplied_entries(self):
+        factory = RequestFactory()
+        request = factory.get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.9', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(client_ip(request), '203.0.113.9')
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=2):
+            self.assertEqual(client_ip(request), '1.2.3.4')
+            request = factory.get('/', HTTP_X_FORWARDED_FOR='203.0.113.9', REMOTE_ADDR='10.0.0.5')
+            self.assertEqual(client_ip(request), '10.0.0.5')
+
+        for spoofed in ('6.6.6.1', '6.6.6.2', '6.6.6.3'):
+            self.client.post(reverse('login'), {'username': 'limited', 'password': 'x'},
+                             HTTP_X_FORWARDED_FOR=f'{spoofed}, 198.51.100.1')
+        response = self.client.post(reverse('login'), {'username': 'limited', 'password': 'x'},
+                                    HTTP_X_FORWARDED_FOR='6.6.6.4, 198.51.100.1')
+        self.assertEqual(response.status_code, 429)
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False)
+class LoadTestTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_plan_is_reproducible(self):
+        plan = build_plan(DEFAULT_SCENARIO['mix'], 3, 50, seed=7)
+        self.assertEqual(plan, build_plan(DEFAULT_SCENARIO['mix'], 3, 50, seed=7))
+        self.assertNotEqual(plan[0], plan[1])
+        self.assertNotEqual(plan, build_plan(DEFAULT_SCENARIO['mix'], 3, 50, seed=8))
+
+    def test_load_scenario(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as scenario_file:
+            scenario_file.write('{"seed": 3, "users": 2}\n\n{"action": "home", "weight": 2}\n{"action": "login"}\n')
+            scenario_file.flush()
+            scenario = load_scenario(scenario_file.name)
+        self.assertEqual((scenario['seed'], scenario['users'], scenario['requests']), (3, 2, DEFAULT_SCENARIO['requests']))
+        self.assertEqual(scenario['mix'], [{'action': 'home', 'weight': 2.0}, {'action': 'login', 'weight': 1.0}])
+
+    def test_accounts_can_log_in_and_verify(self):
+        accounts = prepare_accounts(2, seed=1)
+        self.assertTrue(self.client.login(username=accounts['usernames'][0], password=accounts['password']))
+        self.client.logout()
+        response = self.client.get(reverse('verify_email', args=[accounts['tokens'][0]]))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertEqual(UserProfile.objects.filter(is_email_verified=True).count(), 3)
+
+    def test_cleanup_only_removes_the_run_accounts(self):
+        fan = User.objects.create_user('loadtest_fan', 'fan@example.com', 'fan-password')
+        first = prepare_accounts(2, seed=1)
+        second = prepare_accounts(2, seed=1)
+        self.assertNotEqual(first['usernames'], second['usernames'])
+
+        self.assertGreater(cleanup_accounts(first['created_ids']), 0)
+        self.assertFalse(User.objects.filter(pk__in=first['created_ids']).exists())
+        self.assertEqual(User.objects.filter(pk__in=second['created_ids']).count(), 4)
+        self.assertTrue(User.objects.filter(pk=fan.pk).exists())
@@ -15,8 +15,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from main.views import profile_captures, profile_capture_download
 
 urlpatterns = [
+    path('admin/profiles/', profile_captures, name='profile_captures'),
+    path('admin/profiles/<str:name>.<str:extension>', profile_capture_download, name='profile_capture_download'),
     path('admin/', admin.site.urls),
     path('', include('main.urls')),
     path('users/', include('api.users.urls')),
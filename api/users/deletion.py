@@ -0,0 +1,115 @@
+import logging
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from api.posts.feeds import invalidate_feeds
+from api.posts.mentions import release_unread
+from api.posts.models import Notification, PostArchive, UserShard
+from api.posts.sharding import user_posts
+from .models import AccountDeletion, UserProfile
+
+logger = logging.getLogger('api.users')
+
+def request_account_deletion(user):
+    """
+    Deactivate a user immediately and queue the removal of their data
+
+    Deactivation logs the user out of every session (inactive users are
+    rejected by the auth backend), the rows themselves are removed later by
+    ``process_account_deletions`` in bounded batches.
+
+    Args:
+        user: User to delete
+
+    Returns:
+        AccountDeletion: Tracking row for the deletion
+    """
+
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        deletion, created = AccountDeletion.objects.get_or_create(
+            user_id=user.pk,
+            defaults={'username': user.username}
+        )
+    if created:
+        logger.info(f'Account deletion requested for {user.username}')
+    return deletion
+
+def has_pending_deletion(user_id):
+    """True while ``user_id`` is queued for deletion, the account must stay deactivated until then"""
+    return AccountDeletion.objects.filter(user_id=user_id).exclude(stage='done').exists()
+
+def _is_reactivated(user_id):
+    return User.objects.filter(pk=user_id, is_active=True).exists()
+
+def cancel_deletion(deletion):
+    """Drop the tracking row of a deletion whose account is active again, removed rows stay removed"""
+    AccountDeletion.objects.filter(pk=deletion.pk).delete()
+    logger.warning(f'Account deletion cancelled for {deletion.username}, the account was reactivated')
+
+def _stage_queryset(stage, user_id):
+    if stage == 'notifications':
+        return Notification.objects.filter(recipient_id=user_id)
+    if stage == 'mentions':
+        return Notification.objects.filter(actor_id=user_id)
+    if stage == 'posts':
+        return user_posts(user_id)
+    if stage == 'archived_posts':
+        return user_posts(user_id, PostArchive)
+    return None
+
+def process_deletion(deletion, batch_size=500):
+    """
+    Remove a queued account's rows in bounded batches
+
+    Stages run in order (inbox notifications, mentions in other inboxes,
+    posts with their tags and notifications, archived posts, then profile and
+    user). Each batch and its progress update commit together, so the
+    deletion can be interrupted and resumed at any point. The deletion is
+    cancelled if the account was reactivated in the meantime.
+
+    Args:
+        deletion: AccountDeletion to advance
+        batch_size: Rows removed per transaction
+
+    Yields:
+        int: Number of rows removed by each batch
+    """
+
+    while not deletion.is_complete:
+        if _is_reactivated(deletion.user_id):
+            cancel_deletion(deletion)
+            return
+        queryset = _stage_queryset(deletion.stage, deletion.user_id)
+        if queryset is None:
+            with transaction.atomic():
+                # the account may have been reactivated since the check above
+                deleted, _ = User.objects.filter(pk=deletion.user_id, is_active=False).delete()
+                if not deleted and _is_reactivated(deletion.user_id):
+                    cancel_deletion(deletion)
+                    return
+                UserShard.objects.filter(user_id=deletion.user_id).delete()
+                deletion.rows_deleted += deleted
+                deletion.stage = 'done'
+                deletion.completed_at = timezone.now()
+                deletion.save(update_fields=['rows_deleted', 'stage', 'completed_at'])
+                transaction.on_commit(invalidate_feeds)
+            logger.info(f'Account deletion completed for {deletion.username}')
+            yield deleted
+            return
+
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        with transaction.atomic(), transaction.atomic(using=queryset.db):
+            if pks:
+                if deletion.stage == 'mentions':
+                    release_unread(pks)
+                deleted, _ = queryset.filter(pk__in=pks).delete()
+                deletion.rows_deleted += deleted
+                if deletion.stage == 'posts':
+                    transaction.on_commit(invalidate_feeds)
+            else:
+                deleted = 0
+                deletion.stage = AccountDeletion.STAGES[AccountDeletion.STAGES.index(deletion.stage) + 1]
+            deletion.save(update_fields=['rows_deleted', 'stage'])
+        if deleted:
+            yield deleted
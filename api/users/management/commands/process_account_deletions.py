@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from api.users.models import AccountDeletion
+from api.users.deletion import process_deletion
+
+
+class Command(BaseCommand):
+    help = 'Remove the data of deactivated accounts queued for deletion, in resumable batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.ACCOUNT_DELETION_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches (the next run resumes)')
+
+    def handle(self, *args, **options):
+        batches = 0
+        # ids first, the rows are saved while we go and SQLite gives no isolation to an open cursor
+        pending = list(AccountDeletion.objects.exclude(stage='done').values_list('pk', flat=True))
+        for deletion_id in pending:
+            deletion = AccountDeletion.objects.filter(pk=deletion_id).first()
+            if deletion is None or deletion.is_complete:
+                continue
+            self.stdout.write(f'Deleting {deletion.username} (stage: {deletion.stage}, {deletion.rows_deleted} rows so far)')
+            for deleted in process_deletion(deletion, batch_size=options['batch_size']):
+                batches += 1
+                self.stdout.write(f'  {deletion.stage}: removed {deleted} rows ({deletion.rows_deleted} total)')
+                if options['max_batches'] and batches >= options['max_batches']:
+                    self.stdout.write(self.style.WARNING(f'Stopped after {batches} batches, run again to resume'))
+                    return
+            if deletion.is_complete:
+                self.stdout.write(f'Finished {deletion.username}: {deletion.rows_deleted} rows removed')
+            else:
+                self.stdout.write(self.style.WARNING(f'Cancelled {deletion.username}: the account was reactivated'))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully processed pending account deletions in {batches} batches!')
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-19 03:48
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_userprofile_unread_notifications'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='email_verification_token',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4, editable=False),
+        ),
+    ]
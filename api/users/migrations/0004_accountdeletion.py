@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-19 03:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_verification_token_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(unique=True)),
+                ('username', models.CharField(max_length=150)),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('stage', models.CharField(default='notifications', max_length=20)),
+                ('rows_deleted', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['requested_at'],
+            },
+        ),
+    ]
@@ -7,8 +7,10 @@ from datetime import timedelta
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     is_email_verified = models.BooleanField(default=False)
-    email_verification_token = models.UUIDField(default=uuid.uuid4, editable=False)
+    email_verification_token = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
     email_verification_sent_at = models.DateTimeField(null=True, blank=True)
+    # denormalized so the navbar badge never needs a COUNT query
+    unread_notifications = models.PositiveIntegerField(default=0)
 
     def is_verification_token_expired(self):
         if self.email_verification_sent_at:
@@ -20,3 +22,25 @@ class UserProfile(models.Model):
         self.email_verification_token = uuid.uuid4()
         self.email_verification_sent_at = timezone.now()
         self.save()
+
+class AccountDeletion(models.Model):
+    """Progress of the background removal of a deactivated account"""
+    STAGES = ["notifications", "mentions", "posts", "archived_posts", "account", "done"]
+
+    # plain ids, the tracking row outlives the user it describes
+    user_id = models.IntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    requested_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    stage = models.CharField(max_length=20, default="notifications")
+    rows_deleted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["requested_at"]
+
+    def __str__(self):
+        return f"Deletion of {self.username} ({self.stage})"
+
+    @property
+    def is_complete(self):
+        return self.stage == "done"
@@ -0,0 +1,95 @@
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from api.posts.archive import archive_posts
+from api.posts.mentions import record_mentions
+from api.posts.models import Notification, Post, PostArchive
+from api.posts.sharding import user_posts
+from .deletion import has_pending_deletion, process_deletion, request_account_deletion
+from .models import AccountDeletion, UserProfile
+
+
+def create_user(username):
+    user = User.objects.create_user(username, f'{username}@example.com', 'test-password')
+    UserProfile.objects.create(user=user, is_email_verified=True)
+    return user
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False)
+class AccountDeletionTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.leaving = create_user('leaving')
+        self.friend = create_user('friend')
+        posts = []
+        for number in range(3):
+            posts.append(Post.objects.create(user=self.leaving, message=f'Hi @friend {number}'))
+            record_mentions(posts[-1])
+            record_mentions(Post.objects.create(user=self.friend, message=f'Hi @leaving {number}'))
+        for _ in archive_posts(user_posts(self.leaving.pk).filter(pk=posts[0].pk)):
+            pass
+
+    def unread(self, user):
+        return UserProfile.objects.get(user=user).unread_notifications
+
+    def test_request_deactivates_and_queues_once(self):
+        deletion = request_account_deletion(self.leaving)
+        self.assertEqual(request_account_deletion(self.leaving), deletion)
+        self.assertFalse(User.objects.get(pk=self.leaving.pk).is_active)
+        self.assertTrue(has_pending_deletion(self.leaving.pk))
+        self.assertFalse(self.client.login(username='leaving', password='test-password'))
+
+    def test_interrupted_deletion_resumes_from_its_stage(self):
+        deletion = request_account_deletion(self.leaving)
+        self.assertEqual(self.unread(self.friend), 3)
+
+        # stop after a few batches, as a killed worker would
+        batches = process_deletion(deletion, batch_size=1)
+        self.assertEqual(list(islice(batches, 4)), [1, 1, 1, 1])
+        batches.close()
+
+        saved = AccountDeletion.objects.get(pk=deletion.pk)
+        self.assertEqual(saved.stage, 'mentions')
+        self.assertEqual(saved.rows_deleted, 4)
+        self.assertFalse(Notification.objects.filter(recipient=self.leaving).exists())
+        self.assertEqual(Notification.objects.filter(actor=self.leaving).count(), 2)
+        self.assertEqual(self.unread(self.friend), 2)
+
+        list(process_deletion(saved, batch_size=2))
+        saved.refresh_from_db()
+        self.assertTrue(saved.is_complete)
+        self.assertIsNotNone(saved.completed_at)
+        self.assertFalse(User.objects.filter(pk=self.leaving.pk).exists())
+        self.assertFalse(user_posts(self.leaving.pk).exists())
+        self.assertFalse(user_posts(self.leaving.pk, PostArchive).exists())
+        self.assertFalse(Notification.objects.filter(actor_id=self.leaving.pk).exists())
+        self.assertEqual(self.unread(self.friend), 0)
+        self.assertEqual(user_posts(self.friend.pk).count(), 3)
+        self.assertFalse(has_pending_deletion(self.leaving.pk))
+
+    def test_reactivated_account_cancels_deletion(self):
+        deletion = request_account_deletion(self.leaving)
+        batches = process_deletion(deletion, batch_size=1)
+        next(batches)
+        batches.close()
+
+        User.objects.filter(pk=self.leaving.pk).update(is_active=True)
+        deletion = AccountDeletion.objects.get(pk=deletion.pk)
+        self.assertEqual(list(process_deletion(deletion)), [])
+        self.assertFalse(AccountDeletion.objects.filter(pk=deletion.pk).exists())
+        self.assertTrue(User.objects.filter(pk=self.leaving.pk).exists())
+        self.assertEqual(user_posts(self.leaving.pk).count(), 2)
+
+    def test_command_resumes_across_runs(self):
+        request_account_deletion(self.leaving)
+        call_command('process_account_deletions', batch_size=1, max_batches=2, stdout=open('/dev/null', 'w'))
+        self.assertTrue(has_pending_deletion(self.leaving.pk))
+        call_command('process_account_deletions', batch_size=1, stdout=open('/dev/null', 'w'))
+        self.assertFalse(has_pending_deletion(self.leaving.pk))
+        self.assertFalse(User.objects.filter(pk=self.leaving.pk).exists())
+        self.assertEqual(AccountDeletion.objects.get(user_id=self.leaving.pk).rows_deleted, 11)
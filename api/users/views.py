@@ -6,12 +6,16 @@ from django.views.decorators.csrf import csrf_protect
 from .forms import UserRegisterForm
 from api.utils import send_verification_email
 from .models import UserProfile
+from .deletion import has_pending_deletion
+from api.metrics import logins
+from api.ratelimit import ratelimit
 import logging
 
 # auth logger
 logger = logging.getLogger('api.users')
 
 @csrf_protect
+@ratelimit('register')
 def register_view(request):
     """
     Handle user registration with email verification
@@ -85,6 +89,11 @@ def verify_email(request, token):
     try:
         user_profile = get_object_or_404(UserProfile, email_verification_token=token)
         username = user_profile.user.username
+        if has_pending_deletion(user_profile.user_id):
+            # verifying would reactivate an account queued for deletion
+            logger.warning(f'Verification attempt for {username}, whose account is queued for deletion')
+            messages.error(request, 'Invalid verification link.')
+            return redirect('register')
         
         logger.info(f'Email verification attempt for {username}')
         
@@ -113,6 +122,7 @@ def verify_email(request, token):
         messages.error(request, 'Invalid verification link.')
         return redirect('register')
 
+@ratelimit('resend_verification', methods=None)
 def resend_verification_email(request, user_id):
     """
     Resend verification email to user
@@ -157,6 +167,7 @@ def resend_verification_email(request, user_id):
         return redirect('register')
 
 @csrf_protect
+@ratelimit('login', on_throttle=lambda request: logins.inc(result='throttled'))
 def login_view(request):
     """
     Handle user authentication with email verification check
@@ -180,6 +191,7 @@ def login_view(request):
             
             # user verification checks
             if not user_profile.is_email_verified:
+                logins.inc(result='failed')
                 logger.warning(f'Login attempt with unverified email: {username}')
                 messages.error(request, f'Please verify your email address before logging in. Check your email ({user.email}) for the verification link.')
                 return render(request, 'registration/login.html', {
@@ -209,10 +221,12 @@ def login_view(request):
                 user_profile = user.profile
                 if user_profile.is_email_verified:
                     login(request, user)
+                    logins.inc(result='succeeded')
                     logger.info(f'Successful login: {username}')
                     messages.success(request, f'Welcome back {user.first_name or username}!')
                     return redirect('home')
                 else:
+                    logins.inc(result='failed')
                     logger.warning(f'Login blocked - unverified email: {username}')
                     messages.error(request, 'Please verify your email address before logging in.')
             except UserProfile.DoesNotExist:
@@ -222,10 +236,12 @@ def login_view(request):
                     is_email_verified=True
                 )
                 login(request, user)
+                logins.inc(result='succeeded')
                 logger.info(f'Successful login with auto-created profile: {username}')
                 messages.success(request, f'Welcome back {user.first_name or username}!')
                 return redirect('home')
         else:
+            logins.inc(result='failed')
             logger.warning(f'Failed login attempt: {username}')
             messages.error(request, 'Invalid username or password.')
     
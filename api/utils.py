@@ -4,6 +4,7 @@ from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
 from django.urls import reverse
 from django.conf import settings
+from api.metrics import verification_emails
 
 logger = logging.getLogger(__name__)
 
@@ -52,11 +53,13 @@ def send_verification_email(request, user_profile, context_data=None):
         msg.send()
         
         logger.info(f'Verification email sent successfully to {to_email}')
+        verification_emails.inc(result='sent')
         return True, None
         
     except Exception as e:
         error_msg = f'Failed to send verification email to {user_profile.user.email}: {str(e)}'
         logger.error(error_msg, exc_info=True)
+        verification_emails.inc(result='failed')
         return False, error_msg
 
 
@@ -66,7 +69,7 @@ class EmailService:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
     
-    def send_template_email(self, request, template_name, subject, to_email, context, from_email=None):
+    def send_template_email(self, request, template_name, subject, to_email, context, from_email=None, connection=None):
         """
         Generic method to send templated emails
         
@@ -77,6 +80,7 @@ class EmailService:
             to_email: Recipient email
             context: Template context dict
             from_email: Sender email (optional)
+            connection: Open email backend connection to reuse across sends (optional)
         
         Returns:
             tuple: (success: bool, error_message: str or None)
@@ -88,7 +92,7 @@ class EmailService:
             template = get_template(template_name)
             html_content = template.render(context)
             
-            msg = EmailMultiAlternatives(subject, html_content, from_email, [to_email])
+            msg = EmailMultiAlternatives(subject, html_content, from_email, [to_email], connection=connection)
             msg.attach_alternative(html_content, "text/html")
             msg.send()
             
@@ -1,21 +1,263 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.forms import UserChangeForm
 from django.contrib.auth.models import User
-from api.posts.models import Post
-from api.users.models import UserProfile
+from django.core.paginator import Paginator
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max, Min
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from api.posts.mentions import delete_notifications
+from api.posts.models import Post, PostArchive
+from api.posts.sharding import attach_users, is_sharded, shard_aliases, shard_for_user
+from api.users.models import AccountDeletion, UserProfile
+from api.users.deletion import has_pending_deletion, request_account_deletion
+
+def estimate_row_count(model, using):
+    """
+    Cheap row count estimate for a whole table
+
+    Uses the planner statistics on PostgreSQL and the primary key span (two
+    index lookups) elsewhere.
+
+    Returns:
+        int or None: Estimated number of rows
+    """
+
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return int(row[0])
+        return None
+    span = model._default_manager.using(using).aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if span['max_pk'] is None:
+        return 0
+    return span['max_pk'] - span['min_pk'] + 1
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that skips the exact COUNT(*) for unfiltered changelists of large tables"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+def process_in_chunks(queryset, func, chunk_size=None):
+    """
+    Apply ``func`` to the primary keys of ``queryset`` in bounded chunks
+
+    Each chunk runs in its own transaction so a large selection never holds a
+    long lock on the table.
+
+    Args:
+        queryset: Selection to process
+        func: Callable receiving a list of primary keys
+        chunk_size: Number of primary keys per chunk
+
+    Returns:
+        int: Number of processed rows
+    """
+
+    chunk_size = chunk_size or settings.ADMIN_ACTION_CHUNK_SIZE
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last_pk = None
+    total = 0
+    while True:
+        chunk = list((pks if last_pk is None else pks.filter(pk__gt=last_pk))[:chunk_size])
+        if not chunk:
+            return total
+        with transaction.atomic(using=queryset.db):
+            func(chunk)
+        total += len(chunk)
+        last_pk = chunk[-1]
+
+def prefix_search(queryset, field, search_term):
+    """
+    Case-sensitive prefix search expressed as an index range scan
+
+    ``field >= term AND field < term + U+FFFF`` uses the column's b-tree index
+    on every backend, unlike ``icontains``/``istartswith`` which scan the table.
+    """
+
+    term = search_term.strip()
+    if not term:
+        return queryset, False
+    return queryset.filter(**{f'{field}__gte': term, f'{field}__lt': term + '\uffff'}), False
+
+class UserIdFilter(admin.SimpleListFilter):
+    """Filter by user id without rendering every user in the sidebar"""
+    title = 'user'
+    parameter_name = 'user_id'
+
+    def lookups(self, request, model_admin):
+        user_id = self.value()
+        if user_id and user_id.isdigit():
+            user = User.objects.filter(id=user_id).only('username').first()
+            if user:
+                return [(str(user.id), user.username)]
+        return []
+
+    def queryset(self, request, queryset):
+        if self.value() and self.value().isdigit():
+            return queryset.filter(user_id=self.value())
+        return queryset
+
+class ShardFilter(admin.SimpleListFilter):
+    """Pick the shard to browse, only shown when posts are sharded"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()] if is_sharded() else []
+
+    def queryset(self, request, queryset):
+        # applied by ShardedAdminMixin.get_queryset so change and delete views follow it
+        return queryset
+
+class ShardedAdminMixin:
+    """
+    Serve a sharded model's admin from one shard at a time
+
+    The shard comes from the ``shard`` filter, or from the ``user_id`` filter
+    through the user's placement, and defaults to the first shard. Users are
+    attached with one query since they can't be joined across databases.
+    """
+
+    def get_shard(self, request):
+        params = request.GET
+        if '_changelist_filters' in params:
+            params = QueryDict(params['_changelist_filters'])
+        if params.get('shard') in shard_aliases():
+            return params['shard']
+        user_id = params.get('user_id', '')
+        if user_id.isdigit():
+            return shard_for_user(int(user_id))
+        return shard_aliases()[0]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(self.get_shard(request))
+
+    def get_list_select_related(self, request):
+        return False if is_sharded() else super().get_list_select_related(request)
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        if is_sharded():
+            changelist.result_list = attach_users(list(changelist.result_list))
+        return changelist
+
+    def get_search_results(self, request, queryset, search_term):
+        if not is_sharded() or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        # resolve matching users first, the username can't be joined across databases
+        users, _ = prefix_search(User.objects.all(), 'username', search_term)
+        user_ids = list(users.values_list('id', flat=True)[:settings.ADMIN_ACTION_CHUNK_SIZE])
+        return queryset.filter(user_id__in=user_ids), False
+
+class ScalableAdminMixin:
+    """Changelist settings shared by admins of tables that grow without bound"""
+    list_select_related = ['user']
+    search_fields = ['user__username']
+    search_help_text = 'Username prefix (case-sensitive)'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_search_results(self, request, queryset, search_term):
+        return prefix_search(queryset, 'user__username', search_term)
+
+    @admin.display(description='user', ordering='user__username')
+    def user_link(self, obj):
+        url = reverse(f'admin:{obj._meta.app_label}_{obj._meta.model_name}_changelist')
+        return format_html('<a href="{}?user_id={}">{}</a>', url, obj.user_id, obj.user.username)
+
+    def get_actions(self, request):
+        # the stock action renders every selected object on its confirmation page
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
-    list_display = ['user', 'message', 'timestamp']
-    list_filter = ['timestamp', 'user']
-    search_fields = ['message', 'user__username']
+class PostAdmin(ShardedAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['user_link', 'message', 'timestamp']
+    list_filter = ['timestamp', UserIdFilter, ShardFilter]
+    autocomplete_fields = ['user']
     readonly_fields = ['timestamp']
+    actions = ['delete_in_chunks']
+
+    @admin.action(description='Delete selected posts (in chunks)', permissions=['delete'])
+    def delete_in_chunks(self, request, queryset):
+        def delete(pks):
+            delete_notifications(pks)
+            Post.objects.using(queryset.db).filter(pk__in=pks).delete()
+
+        total = process_in_chunks(queryset, delete)
+        self.message_user(request, f'Deleted {total} posts.', messages.SUCCESS)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            delete_notifications([obj.pk])
+            super().delete_model(request, obj)
+
+@admin.register(PostArchive)
+class PostArchiveAdmin(ShardedAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['user_link', 'message', 'timestamp', 'archived_at']
+    list_filter = [UserIdFilter, ShardFilter]
+    raw_id_fields = ['user']
+    readonly_fields = ['id', 'timestamp', 'archived_at']
+    actions = ['delete_in_chunks']
+
+    @admin.action(description='Delete selected archived posts (in chunks)', permissions=['delete'])
+    def delete_in_chunks(self, request, queryset):
+        def delete(pks):
+            delete_notifications(pks)
+            PostArchive.objects.using(queryset.db).filter(pk__in=pks).delete()
+
+        total = process_in_chunks(queryset, delete)
+        self.message_user(request, f'Deleted {total} archived posts.', messages.SUCCESS)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            delete_notifications([obj.pk])
+            super().delete_model(request, obj)
 
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['user', 'is_email_verified', 'email_verification_sent_at']
     list_filter = ['is_email_verified']
-    search_fields = ['user__username', 'user__email']
+    autocomplete_fields = ['user']
+    actions = ['mark_email_verified']
+
+    @admin.action(description='Mark selected profiles as verified (in chunks)', permissions=['change'])
+    def mark_email_verified(self, request, queryset):
+        def verify(pks):
+            UserProfile.objects.filter(pk__in=pks).update(is_email_verified=True)
+            # only registrations waiting on their email, never deactivated or deleted accounts
+            User.objects.filter(profile__in=pks, is_active=False, last_login__isnull=True).exclude(
+                pk__in=AccountDeletion.objects.values('user_id')
+            ).update(is_active=True)
+
+        total = process_in_chunks(queryset, verify)
+        self.message_user(request, f'Verified {total} profiles.', messages.SUCCESS)
+
+@admin.register(AccountDeletion)
+class AccountDeletionAdmin(admin.ModelAdmin):
+    list_display = ['username', 'user_id', 'stage', 'rows_deleted', 'requested_at', 'completed_at']
+    list_filter = ['stage']
+    readonly_fields = ['user_id', 'username', 'requested_at', 'completed_at', 'stage', 'rows_deleted']
+
+    def has_add_permission(self, request):
+        return False
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -23,8 +265,52 @@ class UserProfileInline(admin.StackedInline):
     verbose_name_plural = 'Profile'
     fk_name = 'user'
 
+class CustomUserChangeForm(UserChangeForm):
+    def clean_is_active(self):
+        is_active = self.cleaned_data['is_active']
+        if is_active and not self.instance.is_active and has_pending_deletion(self.instance.pk):
+            raise forms.ValidationError('This account is queued for deletion and cannot be reactivated.')
+        return is_active
+
 class CustomUserAdmin(UserAdmin):
+    form = CustomUserChangeForm
     inlines = (UserProfileInline,)
+    list_display = ['username', 'email', 'first_name', 'last_name', 'is_staff', 'email_verified']
+    list_select_related = ['profile']
+    search_help_text = 'Username prefix (case-sensitive)'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    actions = ['deactivate_in_chunks']
+
+    @admin.display(description='email verified', boolean=True)
+    def email_verified(self, obj):
+        try:
+            return obj.profile.is_email_verified
+        except UserProfile.DoesNotExist:
+            return None
+
+    @admin.action(description='Deactivate selected users (in chunks)', permissions=['change'])
+    def deactivate_in_chunks(self, request, queryset):
+        total = process_in_chunks(queryset, lambda pks: User.objects.filter(pk__in=pks).update(is_active=False))
+        self.message_user(request, f'Deactivated {total} users.', messages.SUCCESS)
+
+    def get_search_results(self, request, queryset, search_term):
+        return prefix_search(queryset, 'username', search_term)
+
+    def get_deleted_objects(self, objs, request):
+        # deletion is deferred to process_account_deletions, so skip collecting every related row
+        objs = list(objs)
+        perms_needed = set() if self.has_delete_permission(request) else {'user'}
+        return [str(obj) for obj in objs], {'users': len(objs)}, perms_needed, []
+
+    def delete_model(self, request, obj):
+        request_account_deletion(obj)
+        messages.info(request, 'The account was deactivated, its data is removed in the background.')
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            request_account_deletion(user)
+        messages.info(request, 'The accounts were deactivated, their data is removed in the background.')
 
     def get_inline_instances(self, request, obj=None):
         if not obj:
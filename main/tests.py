@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from api.posts.feeds import get_user_counters
+from api.posts.mentions import record_mentions
+from api.posts.models import Notification, Post
+from api.users.models import AccountDeletion, UserProfile
+from .admin import EstimatedCountPaginator, process_in_chunks
+
+
+@override_settings(FEEDS_PREWARM_ENABLED=False, ADMIN_ACTION_CHUNK_SIZE=2)
+class AdminTests(TestCase):
+    databases = {'default', *settings.POSTS_SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'admin-password')
+        self.author = User.objects.create_user('author', 'author@example.com', 'test-password')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'test-password')
+        for user in (self.author, self.reader):
+            UserProfile.objects.create(user=user, is_email_verified=True)
+        self.client.force_login(self.admin)
+
+    def post_mentioning(self, message='Hello @reader'):
+        post = Post.objects.create(user=self.author, message=message)
+        record_mentions(post)
+        return post
+
+    def unread(self):
+        return get_user_counters(self.reader.pk)['unread_notifications']
+
+    def test_paginator_estimates_large_unfiltered_tables(self):
+        for number in range(5):
+            Post.objects.create(user=self.author, message=f'Post {number}')
+        posts = Post.objects.order_by('pk')
+        with override_settings(ADMIN_EXACT_COUNT_THRESHOLD=2):
+            Post.objects.filter(message='Post 2').delete()
+            # the primary key span, without a COUNT(*)
+            self.assertEqual(EstimatedCountPaginator(posts, 10).count, 5)
+            self.assertEqual(EstimatedCountPaginator(posts.filter(user=self.author), 10).count, 4)
+        self.assertEqual(EstimatedCountPaginator(posts, 10).count, 4)
+
+    def test_process_in_chunks(self):
+        for number in range(5):
+            Post.objects.create(user=self.author, message=f'Post {number}')
+        chunks = []
+        self.assertEqual(process_in_chunks(Post.objects.all(), chunks.append), 5)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+    def test_deleting_posts_releases_unread_mentions(self):
+        posts = [self.post_mentioning() for _ in range(3)]
+        self.assertEqual(self.unread(), 3)
+        Notification.objects.filter(post=posts[0]).update(is_read=True)
+        UserProfile.objects.filter(user=self.reader).update(unread_notifications=2)
+        cache.clear()
+
+        self.assertEqual(self.unread(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:posts_post_changelist'), {
+                'action': 'delete_in_chunks', '_selected_action': [post.pk for post in posts[:2]]
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Post.objects.filter(user=self.author).count(), 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.reader).count(), 1)
+        self.assertEqual(self.unread(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:posts_post_delete', args=[posts[2].pk]), {'post': 'yes'})
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.unread(), 0)
+
+    def test_mark_email_verified_skips_deleted_accounts(self):
+        pending = User.objects.create_user('pending', 'pending@example.com', 'test-password', is_active=False)
+        deleted = User.objects.create_user('deleted', 'deleted@example.com', 'test-password', is_active=False)
+        profiles = [UserProfile.objects.create(user=user) for user in (pending, deleted)]
+        AccountDeletion.objects.create(user_id=deleted.pk, username='deleted')
+
+        self.client.post(reverse('admin:users_userprofile_changelist'), {
+            'action': 'mark_email_verified', '_selected_action': [profile.pk for profile in profiles]
+        })
+        self.assertEqual(UserProfile.objects.filter(pk__in=[p.pk for p in profiles], is_email_verified=True).count(), 2)
+        self.assertTrue(User.objects.get(pk=pending.pk).is_active)
+        self.assertFalse(User.objects.get(pk=deleted.pk).is_active)
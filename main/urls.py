@@ -7,4 +7,5 @@ urlpatterns = [
     path('login/', login_view, name='login'),
     path('register/', register_view, name='register'),
     path('logout/', logout_view, name='logout'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,10 +1,18 @@
 from django.shortcuts import render
+from django.http import FileResponse, Http404, HttpResponse
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
-from api.posts.models import Post
-from django.db.models import Count
+from api.posts.feeds import get_recent_posts, get_sidebar_users
+from api.posts.hashtags import trending_hashtags
+from api.metrics import REGISTRY, render as render_metrics
+from api.profiling import capture_path, list_captures
+from datetime import datetime, timezone
 
 @login_required
 def home_view(request):
@@ -18,15 +26,77 @@ def home_view(request):
         HttpResponse: Home page template
     """
 
-    users = User.objects.annotate(
-        post_count=Count('posts')
-    ).order_by('username')
+    context = {
+        'users': get_sidebar_users(),
+        'recent_posts': get_recent_posts(),
+        'trending': trending_hashtags()
+    }
+
+    return render(request, 'home.html', context)
+
+def metrics_view(request):
+    """
+    Expose application metrics in the Prometheus text format
+
+    Access requires a staff session or an ``Authorization: Bearer <METRICS_TOKEN>``
+    header. Snapshots of sibling worker processes are merged in when
+    ``METRICS_MULTIPROC_DIR`` is set.
+    
+    Args:
+        request: Django request object
+    
+    Returns:
+        HttpResponse: Metrics in the text exposition format
+    """
+
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    has_token = bool(token) and constant_time_compare(authorization, f'Bearer {token}')
+    if not has_token and not request.user.is_staff:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+
+    families = REGISTRY.collect(settings.METRICS_MULTIPROC_DIR or None)
+    return HttpResponse(render_metrics(families), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def profile_captures(request):
+    """
+    List the saved per-request profiling captures
     
-    recent_posts = Post.objects.all()[:10]
+    Args:
+        request: Django request object
     
+    Returns:
+        HttpResponse: Admin page listing the captures
+    """
+
+    captures = list_captures()
+    for capture in captures:
+        capture['created_at'] = datetime.fromtimestamp(capture['created'], tz=timezone.utc)
+
     context = {
-        'users': users,
-        'recent_posts': recent_posts
+        **admin.site.each_context(request),
+        'title': 'Profiling captures',
+        'captures': captures,
+        'max_captures': settings.PROFILING_MAX_CAPTURES
     }
+    return render(request, 'admin/profile_captures.html', context)
 
-    return render(request, 'home.html', context)
+@staff_member_required
+def profile_capture_download(request, name, extension):
+    """
+    Download a capture's text report or raw pstats file
+    
+    Args:
+        request: Django request object
+        name: Capture name
+        extension: ``txt`` for the report, ``prof`` for the pstats dump
+    
+    Returns:
+        FileResponse: Capture file attachment
+    """
+
+    path = capture_path(name, extension)
+    if path is None:
+        raise Http404('Capture not found')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)